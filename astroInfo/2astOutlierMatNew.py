@@ -5,10 +5,8 @@
 #########################################################################################
 
 ## IMPORTS ##############################################################################
-from pymongo import MongoClient
 from pprint import pprint
 import pandas as pd
-import statistics as stat
 import matplotlib.pyplot as plt
 from matplotlib import gridspec
 import mplcursors
@@ -16,28 +14,25 @@ import numpy as np
 import random as rand
 import pdb
 import sys
-import configparser as cfp
+import os
+import json
+import asyncio
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from functools import partial
 #from line_profiler import profile
 # custom py file imports
 # import asteroidMenuClass as menu
+import obsCache
+import sigmaEngine
+import sigmaStore
+import snapsDB
 
 ## MONGO CONNECTION #####################################################################
-def getSecrets():
-    config = cfp.ConfigParser()
-    config.read( 'config.ini' )
-    user = config.get( 'Database', 'dbUser' )
-    host = config.get( 'Database', 'dbHost' )
-    port = config.get( 'Database', 'dbPort' )
-    pswd = config.get( 'Database', 'dbPass' )
-
-    return [ user, host, port, pswd ]
-    
-user, host, port, pswd = getSecrets()
-dest = "mongodb://" + user + ":" + pswd + "@" + host + ":" + port
-client = MongoClient( dest )
-db = client.ztf
-mag18Database = db[ 'mag18o8' ] # all asteroids with mag18o8 data
-asteroid_data = db[ 'asteroids_all' ]
+# snapsDB connects lazily on the first query ( details in config.ini ) and keeps one
+# pooled client per process, so importing this file never touches the network
+mag18Name = 'mag18o8' # all asteroids with mag18o8 data
+asteroidsName = 'asteroids_all'
 
 ## GLOBAL VARS ##########################################################################
 useMsg = "How this program works: \n\
@@ -72,7 +67,7 @@ argsExpl = "Command Line Arguments Format & Meaning: \n\
 4. fltrLvl: the intensity of your chosen filter. \n\
 \t for filter 1: 0, 2, 3, 4 (number of outliers per night) \n\
 \t for filter 2: any number 0-99, 0 = not anomalous, 100 = very anomalous \n\
-\t for filter 3: --> new prompt to get weights for each attribute \n\
+\t for filter 3: minimum weighted mean absolute sigma (weights from --weights) \n\
 5. plots: include plots and diagrams as well as written data \n\
 6. exportFlg: export outputs to file. Note: if plots are included, \n\
 \t plots will export as individual .png files and text will output to \n\
@@ -88,6 +83,42 @@ When viewing only one asteroid, \n\
 \t 3. lower filter bound (...) \n\
 \t 4. upper filter bound (...) \n\
 \n\
+Optional Flags (given anywhere as --flag value): \n\
+\t --batchSize: number of asteroids pulled from the database per query (default 500) \n\
+\t --engine: where the sigma matrix is computed (default client) \n\
+\t\t client: fetch every observation and compute locally \n\
+\t\t server: compute per-asteroid summaries inside MongoDB (no per-asteroid plots) \n\
+\t\t vector: fetch like client, then score each whole batch at once with numpy \n\
+\t --cache: directory of a local observation cache to read from instead of MongoDB \n\
+\t --cacheSync: pull new observations into the cache before running (default True) \n\
+\t --nameIndex: path of the local asteroid name index (default astNames, '' to always scan) \n\
+\t --prefetch: batches fetched ahead while the current one is scored (default 2, 0 = off) \n\
+\t --workers: processes that fetch and score shards of the range in parallel (default 1) \n\
+\t --sigmaMode: how far out an outlier is measured (default mean) \n\
+\t\t mean: distance from the mean in standard deviations \n\
+\t\t robust: distance from the median in MADs (scaled to match stdev on normal data), \n\
+\t\t\t not dragged by the outliers themselves \n\
+\t --topK: average the k most extreme values of each feature instead of the single \n\
+\t\t min / max, damping single-point glitches (default 1) \n\
+\t --topSkip: most extreme values skipped before averaging (default 0, e.g. --topK 3 \n\
+\t\t --topSkip 1 averages the 2nd-4th most extreme values) \n\
+\t --coincidence: when outliers coincide for filter type 1 (default night) \n\
+\t\t night: observed the same night \n\
+\t\t obs: from the same observation (same jd) \n\
+\t\t a number of days, e.g. 0.5: jds within that many days of each other \n\
+\t --weights: feature weights for filter type 3, as feature=weight pairs \n\
+\t\t (e.g. elong=2,rb=0.5) or a .json file of them (default weightDict) \n\
+\t --features: features to score instead of elong, rb, H, mag18omag8, as a comma \n\
+\t\t separated list (e.g. elong,rb), a .json file holding a list, or all for every \n\
+\t\t numeric field of attrList. Only these columns are fetched \n\
+\t --bands: score every feature separately in each ZTF band (fid) listed, e.g. 1,2 \n\
+\t\t for g and r, so colour differences don't count as outliers. Each feature's \n\
+\t\t sigma comes from its most anomalous band and every band gets its own \n\
+\t\t sigma column (default '', bands mixed) \n\
+\t --store: directory to save the sigma matrix in, for sigmaStore.py queries \n\
+\t --query: only show asteroids matching an expression over the table columns, \n\
+\t\t e.g. 'elong > 3 and abs(rb) < 2' (see sigmaStore.py) \n\
+\n\
 "
 
 offset = 0 # for shifting data scope
@@ -95,6 +126,7 @@ attrList = "ssnamenr, jd, fid, pid, diffmaglim, ra, dec, magpsf, sigmapsf, \
 chipsf, magap, sigmagap, magapbig, sigmagapbig, distnr, magnr, fwhm, elong, rb, \
 ssdistnr, ssmagnr, id, night, phaseangle, obsdist, heliodist, H, ltc, mag18omag8"
 # attrList is for users to choose attrs to filter by
+attrNames = [ attr.strip( ) for attr in attrList.split( "," ) ]
 
 # Top 4 Attributes of Interest:
 # mag180mag8 : sigma value for difference in 18" aperture vs 8" aperture photos
@@ -102,18 +134,82 @@ ssdistnr, ssmagnr, id, night, phaseangle, obsdist, heliodist, H, ltc, mag18omag8
 # rb (real-bogus ): value to represent the "validity" or "trustworthiness" of the
 # collected data
 # H: another measurement of brightness
+# wantedAttrs is the default feature set; --features picks another one for a
+# run ( see setFeatures ), which rebuilds dataCols, numFeatures, ratingAttrs and
+# resultDtype from it
 wantedAttrs = [ "elong", "rb", "H", "mag18omag8" ] # attributes we want to look at
 # wantedAttrs = [ ]
+defaultFeatures = wantedAttrs.copy( ) # what a run without --features scores
 dataCols = wantedAttrs.copy()
 dataCols.extend( [ 'jd', 'id', 'ssnamenr' ] ) # additional cols needed for processing
 numFeatures = len( wantedAttrs )
-antIDS = list( ) # list for associated ztf id for observation
+bandList = [ ] # ZTF bands ( fid ) scored separately, empty to mix them ( see setBands )
+# fields that can't be scored: the asteroid name and the ZTF id ( a string )
+featureAttrs = [ attr for attr in attrNames if attr not in [ "ssnamenr", "id" ] ]
+ratingAttrs = [ "elong", "rb", "mag18omag8" ] # wanted attributes used for the anomaly rating
+# which end of each rating attribute is anomalous: 1 high values, -1 low values
+# ( an oblong shape, a large 18" vs 8" aperture difference and a low real-bogus
+# score are the interesting ends ). Only wanted attributes listed here are rated
+ratingDirs = {
+    "elong": 1,
+    "rb": -1,
+    "mag18omag8": 1
+}
 weightDict = {
     "H": 1,
     "mag18omag8": 1,
     "elong": 1,
     "rb": 1
-} # not currently used 
+} # scales each feature's sigmas and its share of the anomaly rating ( and is the
+  # default weighting of filter 3, see filterWeights )
+
+# makeResultDtype: takes the number of features and of separately scored bands,
+# returns the dtype of the one record per asteroid holding everything a run keeps
+# about it; a run collects them in a structured array preallocated for its whole
+# range ( see newResults )
+def makeResultDtype( numFeatures, numBands=0 ):
+    fields = [
+        ( "name", np.int64 ), # ssnamenr
+        ( "found", np.bool_ ), # asteroid had observations
+        ( "kept", np.bool_ ), # asteroid passed the filter
+        ( "sigma", np.float64, ( numFeatures, ) ), # weighted sigma of each feature's outlier
+        ( "id", "U32", ( numFeatures, ) ), # ZTF id of each feature's outlier
+        ( "jd", np.float64, ( numFeatures, ) ), # jd of each feature's outlier
+        ( "outlier", np.float64, ( numFeatures, ) ), # value of each feature's outlier
+        ( "night", np.float64, ( numFeatures, ) ), # night of each feature's outlier ( filter 1 only )
+        ( "rowSum", np.float64 ),
+        ( "absRowSum", np.float64 ),
+        ( "rating", np.float64 ), # anomaly rating, nan unless filtering by rating
+        ( "coincidences", np.int64 ), # most outliers that coincide ( filter 1 only )
+        ( "coincidenceAt", np.float64, ( numFeatures, ) ), # nights ( or jds ) outliers coincide at, nan padded ( filter 1 only )
+        ( "score", np.float64 ) # weighted mean absolute sigma ( filter 3 only )
+    ]
+    if numBands > 0:
+        # weighted sigma of each feature in each band ( nan without observations in it )
+        fields.append( ( "bandSigma", np.float64, ( numFeatures, numBands ) ) )
+    return np.dtype( fields )
+
+resultDtype = makeResultDtype( numFeatures )
+
+# defaults for the optional --flag value arguments
+defaultOpts = {
+    "batchSize": 500, # asteroids fetched per database query in runProgram
+    "engine": "client", # client: compute locally, server: aggregate in MongoDB, vector: numpy per batch
+    "cache": "", # local observation cache directory, "" to read from MongoDB
+    "cacheSync": True, # bring the cache up to date before running
+    "nameIndex": "astNames", # local asteroid name index, "" to scan asteroids_all every run
+    "prefetch": 2, # batches fetched ahead while the current one is scored, 0 = sequential
+    "workers": 1, # processes scoring shards of the asteroid range in parallel
+    "sigmaMode": "mean", # mean: sigmas from mean / stdev, robust: from median / MAD
+    "topK": 1, # extremes averaged per feature ( 1 = the single min / max )
+    "topSkip": 0, # most extreme values skipped before averaging
+    "coincidence": "night", # filter 1 matches outliers by night, obs ( same jd ) or a jd window in days
+    "weights": "", # filter 3 feature weights: "elong=2,rb=0.5" or a .json file, "" for weightDict
+    "bands": "", # ZTF bands ( fid ) scored separately, e.g. "1,2", "" to mix them
+    "features": "", # features to score: "elong,rb", a .json list of them or all, "" for wantedAttrs
+    "store": "", # sigma matrix store directory the run saves its results in, "" to not save
+    "query": "" # expression the printed / exported table is filtered by, "" for every asteroid
+}
 
 ## FUNCTION DEFINITIONS #################################################################
 
@@ -139,6 +235,30 @@ def help( ):
 def leave( ):
     print( "Thank you for using SNAPS!\n" )
 
+# getOptions: takes the command line arguments and pulls out any optional
+# "--flag value" pairs so the positional arguments keep their original order.
+# Returns the positional arguments and a dict of options (defaults filled in)
+def getOptions( argv ):
+    positional = [ ]
+    opts = defaultOpts.copy( )
+    argNum = 0
+    while argNum < len( argv ):
+        arg = argv[ argNum ]
+        if arg.startswith( "--" ) and argNum + 1 < len( argv ):
+            flag = arg[ 2: ]
+            if flag not in defaultOpts:
+                print( "WARNING: unknown option " + arg + " ignored" )
+            elif type( defaultOpts[ flag ] ) == bool:
+                opts[ flag ] = argv[ argNum + 1 ].lower( )[ 0 ] == "t"
+            else:
+                # cast to the same type as the default value
+                opts[ flag ] = type( defaultOpts[ flag ] )( argv[ argNum + 1 ] )
+            argNum += 2
+        else:
+            positional.append( arg )
+            argNum += 1
+    return positional, opts
+
 # exportFile: takes fileType, filename, and data as inputs, exports
 # data to either .html or .csv
 ### TODO: modify program so that getting fileType and filename happen inside
@@ -189,77 +309,28 @@ def exportFile( fileType, filename, data ):
         
     # return [ fltrType, fltrLvl ]
 
-# normValue: takes element to normalize, min, and max values and normalizes to [ 0,1 ]
-#@profile
-def normValue( value, minVal, maxVal ):
-    normVal = ( value - minVal ) / ( maxVal - minVal )
-    return normVal
-
-# normDataset: takes in dataset (need not be single-column ) and normalizes
-# to range [ 0,1 ]
-#@profile
-def normDataset( astData ):
-    normalizedData = astData.copy( )
-    for col in wantedAttrs:
-        sortedData = astData.sort_values( by = [ col ] )
-        minVal = sortedData[ col ].iloc[ 0 ]
-        maxVal = sortedData[ col ].iloc[ len( sortedData ) - 1 ]
-        for row in range( len( astData[ col ] ) ):
-            newVal = normValue( astData[ col ][ row ], minVal, maxVal )
-            normalizedData.loc[ row, col ] = newVal
-    return normalizedData
-
-# getObsRating: helper function to getAllObsRatings responsible for getting the
-# rating for a single observation for an asteroid
-#@profile
-def getObsRating( attr, row ):
-    obsRating = 0
-    for val in row:
-        if attr in [ "elong", "mag18omag8" ]:
-            obsRating += float( val )
-        else:
-            obsRating += float( 1 - val )
-    # return obsRating
-    return ( obsRating / 3 ) # hardcoded: needs to be number of wanted attributes
-
-# getAllObsRatings: helper function to getAstRating responsible for getting
-# the ratings for all observations for a given asteroid
-#@profile
-def getAllObsRatings( data, attr ):
-    ratings = [ ]
-    for ind, row in data.iterrows():
-        obsRating = getObsRating( attr, row )
-        ratings.append( obsRating )
-    return ratings
-
 # getAstRating: provides a rating for an asteroid based on highest observation
-# rating for the asteroid based on outliers
+# rating for the asteroid based on outliers. Returns the rating of every
+# observation ( in the data's row order ), the asteroid's rating ( 0-100 ) and
+# the row of its best rated observation
 #@profile
 def getAstRating( inData, plots, export ):
-    # plots = False
-    ratings = [ ]
-    frames = [ ]
-    newAttrs = [ 'elong', 'rb', 'mag18omag8' ]
-    data = inData[ dataCols ]
-    for attr in newAttrs:
-        sortedData = data.sort_values( by = [ attr ] )
-        ratingsData = sortedData[ 'jd' ]
-        normData = normDataset( sortedData )
-        ratings = getAllObsRatings( normData[ newAttrs ], attr )
-
-    ratingsDF = pd.DataFrame( data=ratings, columns=[ 'ratings' ] )
-    ratingsData = pd.concat( [ ratingsDF, ratingsData ], axis=1, join='inner' )
+    ratingData = np.column_stack( [ np.asarray( inData[ attr ], dtype=np.float64 )
+                                    for attr in ratingAttrs ] )
+    ratings, astRating, maxIndex = sigmaEngine.rateAsteroid( ratingData,
+                                                             [ ratingDirs[ attr ] for attr in ratingAttrs ],
+                                                             [ weightDict[ attr ] for attr in ratingAttrs ] )
 
     if plots:
-        plotData = ratingsData.sort_values( by = ['jd'] )
-        plotAstRatings( data[ 'ssnamenr' ][ 0 ], plotData[ 'jd' ], plotData[ 'ratings' ], "jd", "rating", export )
+        jds = np.asarray( inData[ 'jd' ] )
+        order = np.argsort( jds )
+        plotAstRatings( np.asarray( inData[ 'ssnamenr' ] )[ 0 ], jds[ order ], ratings[ order ], "jd", "rating", export )
 
-    astRating = max( ratings ) * 100
-    print( "Max Rating Index: " + str( ratings.index( max( ratings ) ) ) )
-    return ratings, astRating
+    print( "Max Rating Index: " + str( maxIndex ) )
+    return ratings, astRating, maxIndex
 
 # plotAstRating: plots the ratings for each observation of an asteroid as collected
-# in getAllObsratings
+# in getAstRating
 #@profile
 def plotAstRatings( name, xData, yData, xName, yName, export ):
     plt.clf()
@@ -299,97 +370,282 @@ def getAllObs( name, data, exportFlg ):
     pass
             
   
-# formatDataTable: takes in sigma matrix, antares IDs array, asteroid name array,
-# number of asteroids, and number of features and formats the sigma matrix into
-# a more reader-friendly table with headers
+# parseFeatures: takes the --features option, returns the list of features it
+# names: comma separated names, a .json file holding a list of them, or "all"
+# for every numeric attrList field
+def parseFeatures( option ):
+    if option == "all":
+        return featureAttrs.copy( )
+    if option.endswith( ".json" ):
+        with open( option, 'r' ) as file:
+            return list( json.load( file ) )
+    return [ feature.strip( ) for feature in option.split( "," ) if feature.strip( ) ]
+
+# setFeatures: takes a list of features and makes them the wanted attributes of
+# the run, rebuilding everything derived from the feature list: the fetched
+# columns, the result record layout, the rated attributes and the weights
+# ( features without one weigh 1 )
+def setFeatures( features ):
+    global wantedAttrs, dataCols, numFeatures, ratingAttrs, resultDtype
+    for feature in features:
+        if feature not in featureAttrs:
+            raise ValueError( feature + " is not a numeric attrList field, pick from: "
+                              + ", ".join( featureAttrs ) )
+    wantedAttrs = list( dict.fromkeys( features ) )
+    dataCols = wantedAttrs + [ col for col in [ 'jd', 'id', 'ssnamenr' ] if col not in wantedAttrs ]
+    numFeatures = len( wantedAttrs )
+    ratingAttrs = [ attr for attr in ratingDirs if attr in wantedAttrs ]
+    if len( ratingAttrs ) == 0:
+        print( "WARNING: none of " + ", ".join( ratingDirs ) + " are wanted, filter 2 can't be used" )
+    for feature in wantedAttrs:
+        weightDict.setdefault( feature, 1 )
+    resultDtype = makeResultDtype( numFeatures, len( bandList ) )
+
+# setBands: takes the --bands option and makes its bands ( fid values ) the ones
+# scored separately, rebuilding the result record layout for them
+def setBands( option ):
+    global bandList, resultDtype
+    bandList = [ int( band ) for band in option.split( "," ) if band.strip( ) ]
+    resultDtype = makeResultDtype( numFeatures, len( bandList ) )
+
+# canRate: takes the filter type and returns whether a run can use it: the
+# rating filter ( 2 ) needs at least one rating attribute among the features,
+# every engine refuses it otherwise
+def canRate( fltrType ):
+    if fltrType == 2 and len( ratingAttrs ) == 0:
+        print( "ERROR: filter 2 rates " + ", ".join( ratingDirs ) + ", pick at least one of them with --features" )
+        return False
+    return True
+
+# runLayout: takes the run options and returns the feature set and the --bands
+# option they pick: --features or defaultFeatures, and --bands or none
+def runLayout( opts ):
+    if opts[ "features" ]:
+        return parseFeatures( opts[ "features" ] ), opts[ "bands" ]
+    return defaultFeatures, opts[ "bands" ]
+
+# setLayout: takes a feature set and a --bands option and makes them the run's,
+# unless they already are ( see setFeatures and setBands )
+def setLayout( features, bands ):
+    if list( dict.fromkeys( features ) ) != wantedAttrs:
+        setFeatures( features )
+    if [ int( band ) for band in bands.split( "," ) if band.strip( ) ] != bandList:
+        setBands( bands )
+
+# withRunLayout: takes the run options, a function and its arguments. Sets the
+# feature set and bands the options pick before the function makes any result
+# record, runs it and puts the previous ones back, so a run's --features and
+# --bands never carry over to the next run in the same process. Returns what
+# the function returns
+def withRunLayout( opts, runFn, *args ):
+    previous = ( wantedAttrs.copy( ), ",".join( str( band ) for band in bandList ) )
+    setLayout( *runLayout( opts ) )
+    try:
+        return runFn( *args )
+    finally:
+        setLayout( *previous )
+
+# stripZeroRows: takes a table from formatDataTable and drops the rows whose
+# sigmas are all zero ( asteroids the filter stripped )
+def stripZeroRows( dataset ):
+    zeroRows = " and ".join( "`" + feature + "`==0" for feature in wantedAttrs )
+    return dataset.drop( dataset.query( zeroRows ).index )
+
+# newResults: takes a list of asteroid names and returns their preallocated
+# result records, not found and not kept until they are scored
+def newResults( names ):
+    results = np.zeros( len( names ), dtype=resultDtype )
+    results[ "name" ] = names
+    results[ "rating" ] = np.nan
+    results[ "night" ] = np.nan
+    results[ "coincidenceAt" ] = np.nan
+    results[ "score" ] = np.nan
+    return results
+
+# formatDataTable: takes the result records and formats them into a more
+# reader-friendly table with headers: each feature's sigma next to the ZTF id of
+# its outlier, then the row sums and rating. Asteroids the filter stripped are
+# left as rows of zeros ( dropped before export ) and asteroids with no
+# observations have no ids. With coincidence set ( filter 1 ) each asteroid's
+# coincidence count and every night ( or jd ) its outliers coincide at are added,
+# and with weighted set ( filter 3 ) its weighted score
 #@profile
-def formatDataTable( sigmaMatrix, antIDS, nameArray, maxIn, numFeatures ):
-    listNames = [ ]
-    idArray = [ ]
-    listNames= np.array( antIDS )
-    idArray = np.reshape( listNames, ( maxIn, numFeatures ) )
-    if maxIn != 1:
-        dataset = pd.DataFrame(
-            { 'Name': nameArray,
-             'elong': sigmaMatrix[ :, 0 ],
-             'ZTF-ELONG': idArray[ :, 0 ],
-             'rb': sigmaMatrix[ :, 1 ],
-             'ZTF-RB': idArray[ :, 1 ],
-             'H': sigmaMatrix[ :, 2 ],
-             'ZTF-H': idArray[ :, 2 ],
-             'mag18omag8': sigmaMatrix[ :, 3 ],
-             'ZTF-MAG18OMAG8': idArray[ :, 3 ],
-             'Row Sum': sigmaMatrix[ :, 4 ],
-             'Abs Row Sum': sigmaMatrix[ :, 5 ],
-             'Rating': sigmaMatrix[ :, 6 ]
-            } )
-    if maxIn == 1:
-        ### ERROR: code below only works with 1 asteroid from "view one"
-        ### not from 'run program' due to formatting. TODO: Fix this
-        dataset = pd.DataFrame(
-            { 'Name': nameArray,
-             'elong': sigmaMatrix[ 0 ],
-             'ZTF-ELONG': idArray[ :, 0 ],
-             'rb': sigmaMatrix[ 1 ],
-             'ZTF-RB': idArray[ :, 1 ],
-             'H': sigmaMatrix[ 2 ],
-             'ZTF-H': idArray[ :, 2 ],
-             'mag18omag8': sigmaMatrix[ 3 ],
-             'ZTF-MAG18OMAG8': idArray[ :, 3 ],
-             'Row Sum': sigmaMatrix[ 4 ],
-             'Abs Row Sum': sigmaMatrix[ 5 ],
-             'Rating': sigmaMatrix[ 6 ]
-            } )
-        
+def formatDataTable( results, coincidence=False, weighted=False ):
+    kept = results[ "kept" ]
+    dataset = pd.DataFrame( { 'Name': results[ "name" ] } )
+    for featNum, feature in enumerate( wantedAttrs ):
+        ids = results[ "id" ][ :, featNum ].astype( object )
+        ids[ ~results[ "found" ] ] = None
+        dataset[ feature ] = np.where( kept, results[ "sigma" ][ :, featNum ], 0 )
+        dataset[ 'ZTF-' + feature.upper( ) ] = ids
+        for bandNum, band in enumerate( bandList ):
+            dataset[ feature + '-fid' + str( band ) ] = np.where( kept, results[ "bandSigma" ][ :, featNum, bandNum ], 0 )
+    dataset[ 'Row Sum' ] = np.where( kept, results[ "rowSum" ], 0 )
+    dataset[ 'Abs Row Sum' ] = np.where( kept, results[ "absRowSum" ], 0 )
+    dataset[ 'Rating' ] = np.where( kept, results[ "rating" ], 0 )
+    if coincidence:
+        dataset[ 'Coincidences' ] = results[ "coincidences" ]
+        dataset[ 'Coincidence Nights' ] = joinKeys( results[ "coincidenceAt" ] )
+    if weighted:
+        dataset[ 'Weighted Score' ] = np.where( kept, results[ "score" ], 0 )
     return dataset
-    
-# fillSigmaMatrix: takes the name of an asteroid, its data table, and an
-# empty matrix to fill with sigma data. Computes sigmas for each attribute
-# and stores them in the matrix. Returns the sigma matrix and data regarding
-# the night of each observation's max sigma value
-#@profile
-def fillSigmaMatrix( name, asteroid, sigmaMatrix, fltr, outFlag, plot, export ):
-    attrData = [ ]
-    obsData = [ ]
-    outliers = [ ]
-    outliersLoc = [ ]
-    outlierNorms = [ ]
+
+# joinKeys: takes the coincidence keys of each asteroid ( asteroids x features,
+# nan padded ) and returns one string per asteroid listing them, e.g.
+# "2459001, 2459030", empty where nothing coincides
+def joinKeys( keys ):
+    keys = np.asarray( keys, dtype=np.float64 ).reshape( len( keys ), -1 ) # stores from before keeping every key
+    return [ ", ".join( np.format_float_positional( key, trim='-' ) for key in row[ ~np.isnan( row ) ] )
+             for row in keys ]
+
+# filterSigmaRow: takes an asteroid's result record ( sigmas, outlier jds and
+# nights, row sums and rating filled in ), the filter and the coincidence mode.
+# Applies the chosen filter, zeroing the sigmas it drops, and marks whether the
+# asteroid is kept
+def filterSigmaRow( result, fltr, coincidence="night" ):
     stripFlag = False
     fltrType = fltr[ 0 ]
     fltrLevel = fltr[ 1 ]
 
+    #### FILTERING DATA ####
+    if fltrType == 1:
+        # Option 1: filter by number of outliers that coincide ( same night, same
+        # observation or within a jd window, see sigmaEngine.coincidenceKeys )
+        keys, tolerance = sigmaEngine.coincidenceKeys( result[ "jd" ][ None ], result[ "night" ][ None ], coincidence )
+        keep, numZeros, counts, coincidenceAt = sigmaEngine.coincidenceGroups( keys, tolerance, fltrLevel )
+        result[ "sigma" ][ ~keep[ 0 ] ] = 0
+        result[ "coincidences" ] = counts[ 0 ]
+        result[ "coincidenceAt" ] = coincidenceAt[ 0 ]
+        if numZeros[ 0 ] > fltrLevel:
+            stripFlag = True        
+    elif fltrType == 2:
+        # Option 2: filter by specifications
+        # assigns rating to each asteroid on how likely they are to be anomalous
+        # each category is normalized to [ 0,1 ] and the outlying point is rated from
+        # 1 to 100 for each category. Then, scores for each category are averaged to get
+        # total score for the asteroid. ## TODO ( optional ): incorporate weighting system
+        if result[ "rating" ] < fltrLevel:
+            stripFlag = True
+    elif fltrType == 3:
+        # Option 3: filter by weight
+        # scored over the whole finished sigma matrix at once by filterByWeight,
+        # so weights and levels can change without recomputing any sigmas
+        pass
+
+    # setting astRating
+    if fltrType != 2:
+        result[ "rating" ] = np.nan
+
+    result[ "kept" ] = not stripFlag
+
+# filterWeights: takes the run options and returns the filter 3 weight of every
+# wanted feature, in wantedAttrs order. --weights is either feature=weight pairs
+# ( "elong=2,rb=0.5" ) or a .json file holding a { feature: weight } dict;
+# features it leaves out keep their weightDict weight
+def filterWeights( opts ):
+    given = { }
+    if opts[ "weights" ].endswith( ".json" ):
+        with open( opts[ "weights" ], 'r' ) as file:
+            given = dict( json.load( file ) )
+    elif opts[ "weights" ]:
+        for pair in opts[ "weights" ].split( "," ):
+            feature, weight = pair.split( "=" )
+            given[ feature.strip( ) ] = float( weight )
+    for feature in given:
+        if feature not in wantedAttrs:
+            print( "WARNING: weight given for " + feature + ", which is not a wanted feature" )
+    return np.array( [ given.get( feature, weightDict[ feature ] ) for feature in wantedAttrs ], dtype=np.float64 )
+
+# filterByWeight: takes the result records, the filter level, the feature
+# weights ( see filterWeights ) and the weights the sigmas are already scaled
+# by ( weightDict's unless given, in wantedAttrs order ). Those are divided out
+# first, so every feature counts with its filter weight only, then every
+# asteroid is scored in one vectorized pass and those scoring at least the level
+# are kept. Only reads the sigma matrix, so re-filtering with new weights or
+# levels needs no refetching
+def filterByWeight( results, fltrLevel, weights, sigmaWeights=None ):
+    if sigmaWeights is None:
+        sigmaWeights = [ weightDict[ feature ] for feature in wantedAttrs ]
+    sigmaWeights = np.asarray( sigmaWeights, dtype=np.float64 )
+    # a feature weighted 0 has no sigmas left to score
+    with np.errstate( divide='ignore', invalid='ignore' ):
+        sigmas = np.where( sigmaWeights != 0, results[ "sigma" ] / sigmaWeights, 0 )
+    results[ "score" ] = sigmaEngine.weightedScores( sigmas, weights )
+    results[ "kept" ] = results[ "found" ] & ( results[ "score" ] >= fltrLevel )
+    return results
+
+# fillSigmaMatrix: takes the name of an asteroid, its data table, and its
+# result record to fill. Computes sigmas for each attribute and stores them in
+# the record along with the value, jd and ZTF id of each attribute's outlier,
+# the row sums and ( when filtering by rating ) the rating, then applies the
+# filter. The run options pick how sigmas are measured: from the mean in stdevs,
+# or ( sigmaMode robust ) from the median in scaled MADs, out to the single
+# extreme or ( topK / topSkip ) the average of the k most extreme values, with
+# each ZTF band scored separately when bands are set ( see setBands ). Returns
+# the record
+#@profile
+def fillSigmaMatrix( name, asteroid, result, fltr, plot, export, opts=defaultOpts ):
+    fltrType = fltr[ 0 ]
+
     # reset attributes looked at
     attr_ct = 0
     rowSum = absRowSum = 0
 
+    if len( bandList ) != 0:
+        # per-band statistics: score the asteroid as a one-asteroid block, the same
+        # way the vector engine scores a batch
+        columns = [ col for col in dict.fromkeys( dataCols + [ "fid", "night" ] ) if col in asteroid ]
+        block = { "names": np.array( [ int( name ) ] ),
+                  "offsets": np.array( [ 0, len( asteroid[ "jd" ] ) ] ),
+                  "cols": { col: np.asarray( asteroid[ col ] ) for col in columns } }
+        scored = sigmaEngine.sigmaBlock( block, wantedAttrs, weightDict, [ 4, 0 ], ratingAttrs, ratingDirs,
+                                         opts[ "sigmaMode" ], opts[ "topK" ], opts[ "topSkip" ], bands=bandList )
+        for field in [ "sigma", "id", "jd", "outlier", "night", "bandSigma" ]:
+            if field in scored:
+                result[ field ] = scored[ field ][ 0 ]
+        rowSum, absRowSum = scored[ "rowSum" ][ 0 ], scored[ "absRowSum" ][ 0 ]
+        attr_ct = len( wantedAttrs ) # nothing left for the loop below
+    else:
+        # mean and variance of every feature in one pass
+        featStats = sigmaEngine.featureMoments( asteroid, wantedAttrs )
+        if featStats[ "count" ].min( ) < 2:
+            print( "WARNING: asteroid " + str( name ) + " has fewer than 2 values for a feature" )
+        centers = featStats[ "mean" ]
+        scales = np.sqrt( featStats[ "var" ] )
+        if opts[ "sigmaMode" ] == "robust":
+            centers, scales = sigmaEngine.featureRobust( asteroid, wantedAttrs )
+        minVals, minRows = featStats[ "min" ], featStats[ "argmin" ]
+        maxVals, maxRows = featStats[ "max" ], featStats[ "argmax" ]
+        if opts[ "topK" ] != 1 or opts[ "topSkip" ] != 0:
+            # averaged extremes of every feature picked from the data in memory
+            featValues = np.column_stack( [ np.asarray( asteroid[ feature ], dtype=np.float64 )
+                                            for feature in wantedAttrs ] )
+            lowAvg, lowRows, highAvg, highRows = sigmaEngine.segmentTopK(
+                featValues, np.array( [ 0, len( featValues ) ] ), opts[ "topK" ], opts[ "topSkip" ] )
+            minVals, minRows = lowAvg[ 0 ], lowRows[ 0 ]
+            maxVals, maxRows = highAvg[ 0 ], highRows[ 0 ]
+        # positional ( not index label ) access, the same for DataFrames and cache slices
+        jds = np.asarray( asteroid[ "jd" ] )
+        ids = np.asarray( asteroid[ "id" ] )
+        nights = np.asarray( asteroid[ "night" ] ) if "night" in asteroid else None
+
     while ( attr_ct < len( wantedAttrs ) ):
         # grab feature data and calculate mean and standard deviation
         feature = wantedAttrs[ attr_ct ]
-        try: 
-            obj_stdev = stat.stdev( asteroid[ feature ] )
-            obj_mean = stat.mean( asteroid[ feature ] )
-        except Exception as e:
-            print( ( str(name) + " is the object causing error" ), e )
+        obj_stdev = scales[ attr_ct ]
+        obj_mean = centers[ attr_ct ]
             
         # grab weight for feature
         attr_weight = weightDict[ feature ]
 
-        # sort specific asteroid data by feature & normalize
-        # dataSortedByFeature = pd.DataFrame( 
-            # mag18Data.find( { "ssnamenr": int( name ) } ).sort( feature ) )
-        # dataSortedByFeature = pd.DataFrame( 
-            # mag18Data.find( { "ssnamenr": int( name ) } ) )
-        asteroid.sort_values( by = [ feature ] )
-
-        # print( asteroid )
-        # normData = normDataset( dataSortedByFeature )
-
         # calculate min, max, and ranges for highSigma and lowSigma values
-        minIndex = 0
-        maxIndex = len( asteroid ) - 1
+        # the extremes' positions come from the same pass as the mean, so there
+        # is no sort by feature and no extra query per feature
+        minIndex = minRows[ attr_ct ]
+        maxIndex = maxRows[ attr_ct ]
 
-        minVal = ( asteroid[ feature ][ minIndex ] )
-        maxVal = ( asteroid[ feature ][ maxIndex ] )
+        minVal = minVals[ attr_ct ]
+        maxVal = maxVals[ attr_ct ]
 
         upperRange = maxVal - obj_mean
         lowerRange = obj_mean - minVal
@@ -397,97 +653,342 @@ def fillSigmaMatrix( name, asteroid, sigmaMatrix, fltr, outFlag, plot, export ):
         highSigma = upperRange / obj_stdev
         lowSigma = lowerRange / obj_stdev
 
-        featObsDF = asteroid[ [ feature, "jd" ] ]
-
-        
-        # add data to sigmaMatrix
+        # add data to the record
         if ( highSigma > lowSigma ):
-            # jd of observation
-            obs = asteroid[ "jd" ][ maxIndex ]
-
+            outIndex = maxIndex
             rowSum += highSigma * attr_weight
             absRowSum += highSigma * attr_weight
-
-            # keep track of ant id with specific observation
-            antIDS.append( asteroid[ 'id' ][ maxIndex ] )
-            attrData.append( highSigma * attr_weight )
-
-            # store outliers
-            outliers.append( maxVal )
-
-            # calculations for filtering ( opt 2 )
-            # outlierNorms.append( normData[ feature ][ maxIndex ] )
-
+            result[ "sigma" ][ attr_ct ] = highSigma * attr_weight
+            result[ "outlier" ][ attr_ct ] = maxVal
         else:
-            obs = asteroid[ "jd" ][ minIndex ]
+            outIndex = minIndex
             rowSum += -lowSigma * attr_weight
             absRowSum += lowSigma * attr_weight
-
-            # keep track of ant id with specific observation
-            antIDS.append( asteroid[ 'id' ][ minIndex ] )
-            attrData.append( -lowSigma * attr_weight )
-
-            # store outliers
-            outliers.append( minVal )
-
-            # calculations for filtering ( opt 2 )
-            # outlierNorms.append( normData[ feature ][ minIndex ] )
+            result[ "sigma" ][ attr_ct ] = -lowSigma * attr_weight
+            result[ "outlier" ][ attr_ct ] = minVal
+
+        # keep track of ztf id and jd of the outlying observation ( none for a
+        # feature with no values, its row is -1 )
+        if outIndex < 0:
+            result[ "id" ][ attr_ct ] = ""
+            result[ "jd" ][ attr_ct ] = np.nan
+        else:
+            result[ "id" ][ attr_ct ] = ids[ outIndex ]
+            result[ "jd" ][ attr_ct ] = jds[ outIndex ]
+            if nights is not None:
+                result[ "night" ][ attr_ct ] = nights[ outIndex ]
 
         # update attribute count
         attr_ct += 1
-        # add jd of sigma value to list
-        obsData.append( obs )
-
-    rowAttrs = [ ]
-    numZeros = 0
 
-    #### FILTERING DATA ####
+    result[ "found" ] = True
+    result[ "rowSum" ] = rowSum
+    result[ "absRowSum" ] = absRowSum
+    if fltrType == 2:
+        ratings, astRating, maxIndex = getAstRating( asteroid, plot, export )
+        result[ "rating" ] = astRating
+
+    filterSigmaRow( result, fltr, opts[ "coincidence" ] )
+    return result
+
+# neededCols: takes the filter type, plots flag and ( when viewing one asteroid )
+# the feature to filter by, and returns only the columns those steps read. Every
+# query sends this as its projection so unused fields never leave the database
+def neededCols( fltrType, plots, featFltr='n', viewOne=False ):
+    columns = dataCols.copy( )
     if fltrType == 1:
-        # Option 1: filter by number of times outliers occur during single observation
-        for obs in range( len( obsData ) ):
-            if obsData.count( obsData[ obs ] ) >= fltrLevel:
-                rowAttrs.append( attrData[ obs ] )
-            else:
-                rowAttrs.append( 0 )
-                numZeros += 1
-        if numZeros > fltrLevel:
-            stripFlag = True        
-    elif fltrType == 2:
-        # Option 2: filter by specifications
-        # assigns rating to each asteroid on how likely they are to be anomalous
-        # each category is normalized to [ 0,1 ] and the outlying point is rated from
-        # 1 to 100 for each category. Then, scores for each category are averaged to get
-        # total score for the asteroid. ## TODO ( optional ): incorporate weighting system
-        rowAttrs = attrData
-        ratings, astRating = getAstRating( asteroid, plot, export )
-        
-        if astRating < fltrLevel:
-            stripFlag = True
-    elif fltrType == 3:
-        # Option 3: filter by weight
-        ### TODO: Write filter by weight option
-        pass
-    else:
-        pass
+        # outliers are matched by night
+        columns.append( "night" )
+    if len( bandList ) != 0:
+        columns.append( "fid" )
+    if fltrType == 2:
+        columns.extend( ratingAttrs )
+    if plots:
+        columns.extend( [ "rb", "elong", "mag18omag8" ] )
+    if viewOne:
+        # the single asteroid printout and plots split H by band
+        columns.append( "fid" )
+        if featFltr in attrNames:
+            columns.append( featFltr )
+    # drop repeats but keep the order
+    return list( dict.fromkeys( columns ) )
+
+# toProjection: takes a list of columns and returns the matching mongo projection
+def toProjection( columns ):
+    projection = { "_id": 0 }
+    for col in columns:
+        projection[ col ] = 1
+    return projection
+
+# fetchBatch: takes a list of asteroid names and the columns needed, and pulls the
+# observations for all of them with a single $in query instead of one round-trip
+# per asteroid. The result is split by ssnamenr client-side. Returns a dict of
+# name -> DataFrame, each keeping the order the database returned it in (same as
+# a single find)
+#@profile
+def fetchBatch( names, columns=None ):
+    if columns is None:
+        columns = dataCols
+    batchNames = [ int( name ) for name in names ]
+    mag18Database = snapsDB.getCollection( mag18Name )
+    batchData = pd.DataFrame( mag18Database.find( { "ssnamenr": { "$in": batchNames } },
+                                                  toProjection( columns ) ) )
+    astFrames = { }
+    if batchData.empty:
+        return astFrames
+    batchData = batchData[ columns ]
+    for name, astData in batchData.groupby( "ssnamenr", sort=False ):
+        astFrames[ int( name ) ] = astData.reset_index( drop=True )
+    return astFrames
+
+# isValidNumber: takes a field name and returns an aggregation expression that is
+# true when the field holds a number that isn't NaN ( missing, null, string and
+# NaN values are what the client engine skips )
+def isValidNumber( field ):
+    return { "$and": [ { "$isNumber": "$" + field },
+                       { "$gte": [ "$" + field, float( "-inf" ) ] } ] } # NaN sorts below -Infinity
+
+# buildSigmaPipeline: takes a list of asteroid names and builds an aggregation
+# pipeline that computes, per asteroid, everything fillSigmaMatrix needs for each
+# wanted feature: mean, sample stdev, and the min and max observations (value, jd,
+# ZTF id and night). If withRating is set, the anomaly rating from getAstRating is
+# computed on the server as well (needs $setWindowFields, MongoDB 5.0+). Values
+# that aren't numbers are nulled first so every accumulator ignores them, like
+# the NaN-skipping client engine ( needs $isNumber, MongoDB 4.4+ )
+def buildSigmaPipeline( names, withRating ):
+    batchNames = [ int( name ) for name in names ]
+    cleaned = { }
+    for feature in dict.fromkeys( wantedAttrs + ratingAttrs ):
+        cleaned[ feature ] = { "$cond": [ isValidNumber( feature ), "$" + feature, None ] }
+    pipeline = [ { "$match": { "ssnamenr": { "$in": batchNames } } },
+                 { "$project": toProjection( dataCols + [ "night" ] ) }, # wanted + rating attrs, jd, id, night
+                 { "$addFields": cleaned } ]
+    group = { "_id": "$ssnamenr", "count": { "$sum": 1 } }
+
+    for feature in wantedAttrs:
+        # documents compare field by field, so $min/$max keep the jd and id
+        # of the extreme value alongside it. A null val would sort below every
+        # number and win $min, so observations without a value give a null
+        # extreme instead, which $min/$max skip. Equal values are decided by
+        # the jd: the client engine keeps the first ( earliest ) of them, which
+        # $min does on its own and $max does on the negated jd
+        lowObs = { "val": "$" + feature, "jd": "$jd", "id": "$id", "night": "$night" }
+        highObs = { "val": "$" + feature, "jd": { "$multiply": [ -1, "$jd" ] }, "id": "$id", "night": "$night" }
+        group[ feature + "Mean" ] = { "$avg": "$" + feature }
+        group[ feature + "Std" ] = { "$stdDevSamp": "$" + feature }
+        group[ feature + "Min" ] = { "$min": { "$cond": [ { "$isNumber": "$" + feature }, lowObs, None ] } }
+        group[ feature + "Max" ] = { "$max": { "$cond": [ { "$isNumber": "$" + feature }, highObs, None ] } }
+
+    if withRating and ratingAttrs:
+        # attach each asteroid's min/max to every observation so they can be normalized
+        wholeAst = { "documents": [ "unbounded", "unbounded" ] }
+        window = { }
+        for attr in ratingAttrs:
+            window[ attr + "Lo" ] = { "$min": "$" + attr, "window": wholeAst }
+            window[ attr + "Hi" ] = { "$max": "$" + attr, "window": wholeAst }
+        pipeline.append( { "$setWindowFields": { "partitionBy": "$ssnamenr",
+                                                 "output": window } } )
+        normed = [ ]
+        totalWeight = 0
+        for attr in ratingAttrs:
+            attrRange = { "$subtract": [ "$" + attr + "Hi", "$" + attr + "Lo" ] }
+            attrNorm = { "$divide": [ { "$subtract": [ "$" + attr, "$" + attr + "Lo" ] }, attrRange ] }
+            if ratingDirs[ attr ] < 0:
+                attrNorm = { "$subtract": [ 1, attrNorm ] }
+            normed.append( { "$cond": [ { "$eq": [ attrRange, 0 ] }, None,
+                                        { "$multiply": [ attrNorm, weightDict[ attr ] ] } ] } )
+            totalWeight += weightDict[ attr ]
+        # same rating getAstRating gives: weighted mean of the normalized values.
+        # With no rating weight there is nothing to rate ( and $divide fails on
+        # 0 ), the rating stays nan like the client engine's
+        if totalWeight != 0:
+            group[ "rating" ] = { "$max": { "$divide": [ { "$add": normed }, totalWeight ] } }
+
+    pipeline.append( { "$group": group } )
+    return pipeline
+
+# aggregateBatch: takes a list of asteroid names and runs the sigma pipeline on
+# the server so only one small summary per asteroid comes back over the network.
+# Returns a dict of name -> summary document
+#@profile
+def aggregateBatch( names, withRating ):
+    summaries = { }
+    pipeline = buildSigmaPipeline( names, withRating )
+    mag18Database = snapsDB.getCollection( mag18Name )
+    for summary in mag18Database.aggregate( pipeline, allowDiskUse=True ):
+        summaries[ int( summary[ "_id" ] ) ] = summary
+    return summaries
+
+# summaryToResult: takes an asteroid's summary from aggregateBatch, its result
+# record, the filter and the coincidence mode, and fills the record the same way
+# fillSigmaMatrix does from the raw observations
+def summaryToResult( summary, result, fltr, coincidence="night" ):
+    rowSum = absRowSum = 0
+    # stands in for the extremes of a feature with no numeric values
+    noObs = { "val": np.nan, "jd": np.nan, "id": "" }
+
+    for featNum, feature in enumerate( wantedAttrs ):
+        obj_mean = summary[ feature + "Mean" ]
+        obj_mean = np.nan if obj_mean is None else obj_mean # None without numeric values
+        obj_stdev = summary[ feature + "Std" ] or np.nan # None for single observations
+        minObs = summary[ feature + "Min" ] or noObs
+        maxObs = summary[ feature + "Max" ] or noObs
+        maxObs = dict( maxObs, jd=-maxObs[ "jd" ] ) # the max key holds the negated jd
+        attr_weight = weightDict[ feature ]
 
-    # setting rowAttrs and astRating
-    if fltrType != 2:
-        astRating = np.nan
-    if fltrType in [ 3, 4 ]:
-        rowAttrs = attrData
+        highSigma = ( maxObs[ "val" ] - obj_mean ) / obj_stdev
+        lowSigma = ( obj_mean - minObs[ "val" ] ) / obj_stdev
 
-    rowAttrs.append( rowSum )
-    rowAttrs.append( absRowSum )
-    rowAttrs.append( astRating )
-    
-    sigmaMatrix = rowAttrs
-    if stripFlag:
-        sigmaMatrix = [ ]
+        if ( highSigma > lowSigma ):
+            outObs = maxObs
+            rowSum += highSigma * attr_weight
+            absRowSum += highSigma * attr_weight
+            result[ "sigma" ][ featNum ] = highSigma * attr_weight
+        else:
+            outObs = minObs
+            rowSum += -lowSigma * attr_weight
+            absRowSum += lowSigma * attr_weight
+            result[ "sigma" ][ featNum ] = -lowSigma * attr_weight
+        result[ "outlier" ][ featNum ] = outObs[ "val" ]
+        result[ "jd" ][ featNum ] = outObs[ "jd" ]
+        result[ "id" ][ featNum ] = outObs[ "id" ]
+        if outObs.get( "night" ) is not None:
+            result[ "night" ][ featNum ] = outObs[ "night" ]
+
+    result[ "found" ] = True
+    result[ "rowSum" ] = rowSum
+    result[ "absRowSum" ] = absRowSum
+    if summary.get( "rating" ) is not None:
+        result[ "rating" ] = summary[ "rating" ] * 100
+
+    filterSigmaRow( result, fltr, coincidence )
+    return result
+
+# getAsteroidNames: takes the run options and returns every asteroid name in
+# asteroids_all order. Uses the local name index unless it's turned off; a
+# local-only cache run ( --cacheSync False ) trusts the index without checking
+# the database for changes
+def getAsteroidNames( opts ):
+    if not opts[ "nameIndex" ]:
+        asteroid_data = snapsDB.getCollection( asteroidsName )
+        names = pd.DataFrame( asteroid_data.find( {},{ '_id': 0, 'ssnamenr' : 1 } ) )
+        return np.array( names[ "ssnamenr" ] )
+
+    localOnly = opts[ "cache" ] and not opts[ "cacheSync" ]
+    if localOnly and os.path.exists( opts[ "nameIndex" ] + ".npy" ):
+        return obsCache.loadNameIndex( opts[ "nameIndex" ] )
+    return obsCache.loadNameIndex( opts[ "nameIndex" ], snapsDB.getCollection( asteroidsName ) )
+
+# fetchWindow: takes a window of asteroid names, the columns needed, whether the
+# rating is needed, and the run options. Fetches the window from wherever this run
+# reads: the server aggregation, the local cache or a batched query
+def fetchWindow( batchNames, columns, withRating, opts ):
+    if opts[ "engine" ] == "server":
+        return aggregateBatch( batchNames, withRating )
+    if opts[ "cache" ]:
+        # zero-copy slices of the memory-mapped cache, no DataFrame per asteroid
+        return obsCache.readSlices( opts[ "cache" ], batchNames, columns )
+    return fetchBatch( batchNames, columns )
+
+# pipelineWindows: takes a list of name windows, a fetch function, a score function
+# and how many windows to fetch ahead. Fetches run on a thread pool ( pymongo
+# releases the GIL while it waits on the network ) so the next windows download
+# while the current one is being scored. At most "depth" fetches are in flight,
+# which keeps memory bounded, and windows are scored strictly in order, so the
+# sigma matrix comes out the same as a sequential run
+async def pipelineWindows( windows, fetchFn, scoreFn, depth ):
+    loop = asyncio.get_running_loop( )
+    pending = deque( )
+    nextWindow = 0
+    with ThreadPoolExecutor( max_workers=depth ) as pool:
+        while nextWindow < len( windows ) or pending:
+            # top up the fetches in flight, never more than depth
+            while nextWindow < len( windows ) and len( pending ) < depth:
+                window = windows[ nextWindow ]
+                pending.append( ( window, loop.run_in_executor( pool, fetchFn, window ) ) )
+                nextWindow += 1
+            window, fetching = pending.popleft( )
+            batch = await fetching
+            scoreFn( window, batch )
+
+# scoreWindows: takes a list of asteroid name windows, their preallocated result
+# records ( in the same order ), the filter, plots and export flags and the run
+# options. Fetches each window ( ahead of scoring when prefetch is on ), scores it
+# into the records and returns them. Runs either in the main process or as one
+# shard of a --workers run, where each worker process opens its own database
+# client ( snapsDB keys clients by process id ) and its own view of the cache
+def scoreWindows( windows, results, fltr, plots, exportFlg, opts ):
+    # worker processes started fresh ( not forked ) import the default feature
+    # set and bands, a no-op everywhere else
+    setLayout( *runLayout( opts ) )
+    fltrType = fltr[ 0 ]
+    columns = neededCols( fltrType, plots )
+    serverEngine = ( opts[ "engine" ] == "server" )
+    vectorEngine = ( opts[ "engine" ] == "vector" )
+    ast_ct = 0
 
-    if outFlag:
-        return ( sigmaMatrix, obsData, outliers )
+    def fetchFn( batchNames ):
+        return fetchWindow( batchNames, columns, fltrType == 2, opts )
+
+    # scoreFn: fills the result records for one fetched window of asteroids
+    def scoreFn( batchNames, batch ):
+        nonlocal ast_ct
+        if vectorEngine:
+            # score every asteroid of the window in one set of segmented reductions
+            present = [ int( name ) for name in batchNames if int( name ) in batch ]
+            if len( present ) != 0:
+                block = sigmaEngine.toBlock( batch, present, columns )
+                scored = sigmaEngine.sigmaBlock( block, wantedAttrs, weightDict, fltr, ratingAttrs, ratingDirs,
+                                                 opts[ "sigmaMode" ], opts[ "topK" ], opts[ "topSkip" ],
+                                                 opts[ "coincidence" ], bandList )
+                rows = ast_ct + np.array( [ pos for pos, name in enumerate( batchNames ) if int( name ) in batch ] )
+                for field, values in scored.items( ):
+                    results[ field ][ rows ] = values
+                results[ "found" ][ rows ] = True
+
+        for name in batchNames:
+            if int( name ) not in batch:
+                # no observations: the record stays not found
+                print( "WARNING: no observations found for asteroid " + str( name ) )
+                ast_ct += 1
+                continue
+
+            if serverEngine:
+                summaryToResult( batch.pop( int( name ) ), results[ ast_ct ], fltr, opts[ "coincidence" ] )
+                ast_ct += 1
+                continue
+
+            # extremes are found by position, so no sort by jd is needed
+            asteroid = batch.pop( int( name ) )
+            if not vectorEngine:
+                fillSigmaMatrix( name, asteroid, results[ ast_ct ], fltr, plots, exportFlg, opts )
+
+            # update asteroid count
+            ast_ct += 1
+
+            if plots:
+                # the plot hover text needs a DataFrame
+                asteroid = pd.DataFrame( asteroid )
+                plot3Das2D( name, asteroid['rb'],
+                            asteroid['elong'],
+                            asteroid['mag18omag8'],
+                            "rb", "elong", "mag18omag8",
+                            asteroid, exportFlg )
+
+                plot3Dand2D( name, asteroid['rb'],
+                             asteroid['elong'],
+                             asteroid['mag18omag8'],
+                             "rb", "elong", "mag18omag8",
+                             asteroid, exportFlg )
+
+    # Loop through our collection of names, fetching ahead while scoring
+    if opts[ "prefetch" ] > 0:
+        asyncio.run( pipelineWindows( windows, fetchFn, scoreFn, opts[ "prefetch" ] ) )
+    else:
+        for window in windows:
+            scoreFn( window, fetchFn( window ) )
 
-    return ( sigmaMatrix, obsData )
+    return results
 
 ########################################################################################
 ### RUNPROGRAM function
@@ -497,16 +998,22 @@ def fillSigmaMatrix( name, asteroid, sigmaMatrix, fltr, outFlag, plot, export ):
 ### as desired from any starting point in the data, then computes and fills the sigma
 ### matrix and runs data analytics on the results.
 ########################################################################################
+def runProgram( maxIn, offset, exportFlg, exportArgs, fltrType, fltrLvl, plots, opts=defaultOpts ):
+    # scored with the run's own --features and --bands ( see withRunLayout )
+    return withRunLayout( opts, runMatrix, maxIn, offset, exportFlg, exportArgs, fltrType, fltrLvl, plots, opts )
+
+# runMatrix: runProgram's body, run once the feature set and bands are set
 #@profile
-def runProgram( maxIn, offset, exportFlg, exportArgs, fltrType, fltrLvl, plots ):
+def runMatrix( maxIn, offset, exportFlg, exportArgs, fltrType, fltrLvl, plots, opts=defaultOpts ):
     # total num of asteroids we want to look at
     #maxIn = int( input( "How many asteroids do you want to look at( -1 if all ): " ) )
+    if not canRate( fltrType ):
+        return
     
     # get all asteroid names
-    asteroidNames = pd.DataFrame( asteroid_data.find( {},{ '_id': 0, 'ssnamenr' : 1 } ) )
+    asteroidNames = pd.DataFrame( { "ssnamenr": getAsteroidNames( opts ) } )
     fileType, fileName = exportArgs
 
-    featFltr = 'n'
     if ( maxIn < 0 ) :
         # print(asteroid_data)
         maxIn = asteroidNames.size
@@ -527,8 +1034,8 @@ def runProgram( maxIn, offset, exportFlg, exportArgs, fltrType, fltrLvl, plots )
              
     #offset = int( input( "Where to start in data:( -1 if random ):  " ) )
     
-    if ( offset < 0 and maxIn < asteroid_data.count( ) ):
-        offset = rand.randint( 0, asteroid_data.count( ) - maxIn - 1 )
+    if ( offset < 0 and maxIn < len( asteroidNames ) ):
+        offset = rand.randint( 0, len( asteroidNames ) - maxIn - 1 )
 
     # exportFlg = input( "Would you like to export the results ( y/n )? " )
 
@@ -539,79 +1046,78 @@ def runProgram( maxIn, offset, exportFlg, exportArgs, fltrType, fltrLvl, plots )
     # fltr = getFilter( )
     fltr = [ fltrType, fltrLvl ]
         
-    # num of asteroids we have looked at 
-    ast_ct = 0
-
-    #Sigma Matrix
-    extraCols = 3 # for: rowSum, absRowSum, asteroidRating
-    sigmaMatrix = np.zeros( [ maxIn, numFeatures + extraCols ] )
-
-    # necessary data from database
-    # print( "asteroidNames \n" )
-    # astNamesArr = asteroidNames[ "ssnamenr" ][:maxIn].values.tolist()
-    # print( astNamesArr )
-    # mag18DataNew = pd.DataFrame( mag18Database.find( { "ssnamenr": { "$in": astNamesArr } }, { "id": 1, "ssnamenr": 1, "jd": 1, "elong": 1, "rb": 1, "H": 1, "mag18omag8": 1, "night": 1 } ) )
-    # print( mag18DataNew )
-
-    # Loop through our collection of names
-    while ( ast_ct < maxIn and ast_ct < len( asteroidNames ) ):
-        # create temporary row variable to hold asteroid data for appending at the end
-        attrData = [ ]
-        obsData = [ ]
-        arrayOffset = ast_ct + offset
-
-        # grab asteroid name
-        name = asteroidNames[ "ssnamenr" ][ arrayOffset ]
-
-        # reset attributes looked at
-        attr_ct = 0
-
-        # sort specific asteroid data by Julian Date
-        mag18Data = pd.DataFrame( mag18Database.find( { "ssnamenr": int( name ) } ) )
-        mag18Data = mag18Data[ dataCols ]
-        # mag18Data = mag18DataNew
-        asteroid = mag18Data.sort_values( by = [ "jd" ] )
-        attrData, obsData = fillSigmaMatrix( name, asteroid, sigmaMatrix, fltr, False, plots, exportFlg )
-        
-        if len( attrData ) != 0:
-            sigmaMatrix[ ast_ct ] = attrData
-
-        # update asteroid count
-        ast_ct += 1
-
+    # number of asteroids pulled from the database in one query
+    batchSize = max( 1, opts[ "batchSize" ] )
+    if opts[ "engine" ] == "server" and ( opts[ "sigmaMode" ] == "robust" or opts[ "topK" ] != 1 or opts[ "topSkip" ] != 0
+                                          or len( bandList ) != 0 ):
+        print( "WARNING: medians, averaged extremes and per-band sigmas need raw observations, using --engine client" )
+        opts = dict( opts, engine="client" )
+    if opts[ "engine" ] == "server" and plots:
+        print( "WARNING: per-asteroid plots need raw observations, skipping them with --engine server" )
+
+    # one preallocated result record per asteroid in the range
+    lastAst = min( offset + maxIn, len( asteroidNames ) )
+    results = newResults( asteroidNames[ "ssnamenr" ][ offset:lastAst ].tolist( ) )
+
+    # split our collection of names into windows fetched with one query each
+    windows = [ ]
+    if opts[ "workers" ] > 1:
+        # at least one window per worker on short ranges
+        batchSize = max( 1, min( batchSize, -( -len( results ) // opts[ "workers" ] ) ) )
+    for start in range( 0, len( results ), batchSize ):
+        windows.append( results[ "name" ][ start:start + batchSize ].tolist( ) )
+
+    if opts[ "workers" ] > 1 and len( windows ) > 1:
+        # split the windows into contiguous shards, a few per worker so a slow shard
+        # doesn't hold the rest up. Each worker fills its own copy of its shard's
+        # records, which are copied back into place in order
         if plots:
-            plot3Das2D( name, asteroid['rb'],
-                        asteroid['elong'],
-                        asteroid['mag18omag8'],
-                        "rb", "elong", "mag18omag8",
-                        asteroid, exportFlg )
-        
-            plot3Dand2D( name, asteroid['rb'],
-                         asteroid['elong'],
-                         asteroid['mag18omag8'],
-                         "rb", "elong", "mag18omag8",
-                         asteroid, exportFlg )
-
-    # Reset arrays for rerunning program
-    nameArray = [ ]
-    listNames = [ ]
-    idArray = [ ]
-        
-    # Formatting data structures
-    arrayOffset = offset + ast_ct
-    nameArray = np.array( asteroidNames[ 'ssnamenr' ] )[ offset: arrayOffset ]
-
-    dataset = formatDataTable( sigmaMatrix, antIDS, nameArray, maxIn, numFeatures )
-
-    # clear antIDS for next use
-    antIDS.clear( )
+            print( "WARNING: per-asteroid plots need --workers 1, skipping them" )
+        shardSize = -( -len( windows ) // ( opts[ "workers" ] * 4 ) )
+        shards = [ ]
+        shardStarts = [ ]
+        for start in range( 0, len( windows ), shardSize ):
+            shards.append( windows[ start:start + shardSize ] )
+            shardStarts.append( start * batchSize )
+        shardResults = [ results[ start:start + sum( len( window ) for window in shard ) ]
+                         for start, shard in zip( shardStarts, shards ) ]
+        shardFn = partial( scoreWindows, fltr=fltr, plots=False, exportFlg=exportFlg, opts=opts )
+        with ProcessPoolExecutor( max_workers=opts[ "workers" ] ) as pool:
+            for start, scored in zip( shardStarts, pool.map( shardFn, shards, shardResults ) ):
+                results[ start:start + len( scored ) ] = scored
+    else:
+        scoreWindows( windows, results, fltr, plots, exportFlg, opts )
+
+    if fltrType == 3:
+        filterByWeight( results, fltrLvl, filterWeights( opts ) )
+    if opts[ "store" ]:
+        # build once, query many times with sigmaStore.py
+        sigmaStore.saveMatrix( opts[ "store" ], results,
+                               { "features": wantedAttrs, "bands": opts[ "bands" ], "filter": fltr, "offset": offset,
+                                 "sigmaMode": opts[ "sigmaMode" ], "topK": opts[ "topK" ],
+                                 "topSkip": opts[ "topSkip" ],
+                                 # what the sigmas are scaled by, divided out when a query re-weights them
+                                 "sigmaWeights": [ weightDict[ feature ] for feature in wantedAttrs ] } )
+    dataset = formatDataTable( results, coincidence=( fltrType == 1 ), weighted=( fltrType == 3 ) )
+    if fltrType == 1:
+        # coincidence report: asteroids whose outliers coincide, biggest first ( the
+        # full list is in the Coincidences columns of the table )
+        coincident = results[ results[ "coincidences" ] >= max( 2, fltrLvl ) ]
+        coincident = coincident[ np.argsort( -coincident[ "coincidences" ], kind="stable" ) ]
+        print( str( len( coincident ) ) + " asteroids with coinciding outliers ( --coincidence "
+               + str( opts[ "coincidence" ] ) + " ):" )
+        for result in coincident[ :20 ]:
+            print( "\t" + str( result[ "name" ] ) + ": " + str( result[ "coincidences" ] )
+                   + " outliers, coinciding at " + joinKeys( result[ "coincidenceAt" ][ None ] )[ 0 ] )
 
     # EXPORT
     # drop all rows in data where zeros are present ( from filters )
-    ### WARNING: I'm not sure if this works with the new filter system
-    ### TODO: check if it works and fix if it doesn't
-    newData = dataset.drop( 
-        dataset.query( "rb==0 and elong==0 and H==0 and mag18omag8==0" ).index )
+    newData = stripZeroRows( dataset )
+    if opts[ "query" ]:
+        # filter by an expression over the columns ( same engine as sigmaStore.py )
+        newData = sigmaStore.queryMatrix( newData, opts[ "query" ] )
+        if newData.empty:
+            print( "This returns an empty Data Set " )
     if exportFlg:
         exportFile( fileType, fileName, newData )
     else:
@@ -620,63 +1126,33 @@ def runProgram( maxIn, offset, exportFlg, exportArgs, fltrType, fltrLvl, plots )
     # first printout of relevant asteroid data
     # if ( input( "Look at total data histogram ( y/n ): " ) == 'y' ):
     if ( plots ):
-        totalHistFigs, plts = plt.subplots( 2, 3, figsize=( 15,15 ) )
+        # one histogram for the row sums and one per feature, three to a row
+        numRows = -( -( numFeatures + 1 ) // 3 )
+        totalHistFigs, plts = plt.subplots( numRows, 3, figsize=( 15, 7.5 * numRows ), squeeze=False )
+        plts = plts.flatten( )
         totalHistFigs.suptitle( "Histograms" )
 
         # print( "Row Sum Histogram" )
-        plts[ 0,0 ].hist( np.array( dataset[ "Row Sum" ] ) )
-        plts[ 0,0 ].set( xlabel = "num sigmas", ylabel = "num asteroids", title = "Row Sum" )
-
-        elongTest = dataset[ 'elong' ].sum( )
-        rbTest = dataset[ 'rb' ].sum( )
-        hTest = dataset[ 'H' ].sum( )
-        mag18 = dataset[ 'mag18omag8' ].sum( )
-
-        elongTestM = dataset[ 'elong' ].mean( )
-        rbTestM = dataset[ 'rb' ].mean( )
-        hTestM = dataset[ 'H' ].mean( )
-        mag18M = dataset[ 'mag18omag8' ].mean( )
-
-
-        print( "ELONG" )
-        print( "Sum :" + str( elongTest ) )
-        print( "Mean:" + str( elongTestM ) )
-        plts[ 0,1 ].hist( np.array( dataset[ "elong" ] ) )
-        plts[ 0,1 ].set( xlabel = "num sigmas",
-                      ylabel = "num asteroids",
-                      title = "ELONG" )
-
-        print( "RB" )
-        print( "Sum :" + str( rbTest ) )
-        print( "Mean:" + str( rbTestM ) )
-        plts[ 0,2 ].hist( np.array( dataset[ "rb" ] ) )
-        plts[ 0,2 ].set( xlabel = "num sigmas",
-                      ylabel = "num asteroids",
-                      title = "RB" )
-
-        print( "H" )
-        print( "Sum :" + str( hTest ) )
-        print( "Mean:" + str( hTestM ) )
-        plts[ 1,0 ].hist( np.array( dataset[ "H" ] ) )
-        plts[ 1,0 ].set( xlabel = "num sigmas",
-                      ylabel = "num asteroids",
-                      title = "H" )
-
-        print( "MAG18OMAG8" )
-        print( "Sum :" + str( mag18 ) )
-        print( "Mean:" + str( mag18M ) )
-        plts[ 1,1 ].hist( np.array( dataset[ "mag18omag8" ] ) )
-        plts[ 1,1 ].set( xlabel = "num sigmas",
-                      ylabel = "num asteroids",
-                      title = "MAG18OMAG8" )
+        plts[ 0 ].hist( np.array( dataset[ "Row Sum" ] ) )
+        plts[ 0 ].set( xlabel = "num sigmas", ylabel = "num asteroids", title = "Row Sum" )
+
+        for featNum, feature in enumerate( wantedAttrs ):
+            print( feature.upper( ) )
+            print( "Sum :" + str( dataset[ feature ].sum( ) ) )
+            print( "Mean:" + str( dataset[ feature ].mean( ) ) )
+            plts[ featNum + 1 ].hist( np.array( dataset[ feature ] ) )
+            plts[ featNum + 1 ].set( xlabel = "num sigmas",
+                                     ylabel = "num asteroids",
+                                     title = feature.upper( ) )
 
         # adjust the spacing so things don't overlap
         totalHistFigs.subplots_adjust( 
                             wspace=0.4,
                             hspace=0.4 )
 
-        # delete currently unused 6th plot space
-        totalHistFigs.delaxes( plts[ 1,2 ] )
+        # delete currently unused plot spaces
+        for unused in plts[ numFeatures + 1: ]:
+            totalHistFigs.delaxes( unused )
 
         # show the total histogram plots
         totalHistFigs.show( )
@@ -690,43 +1166,8 @@ def runProgram( maxIn, offset, exportFlg, exportArgs, fltrType, fltrLvl, plots )
     # HLowFlag = dataset[ dataset[ 'H' ] <= -4 ]
     # elongHighFlag = dataset[ dataset[ 'elong' ] >= 4 ]
 
-    # filtering loop for individual attributes
-    filteredDataset = dataset
-    emptyFlag = False
-    continueFlag = ( featFltr != 'n' ) # will not start if no featFltr was given at start
-
-    while ( continueFlag and( not emptyFlag ) ):
-        # filterInput = input( "Enter feature to filter by( 'n' if None ): \n" )
-        # continueFlag = ( filterInput != 'n' )
-
-        if ( continueFlag ):
-            filterHighLimit = int( input( "Data >  " ) )
-            filterLowLimit = int( input( "Data <  " ) )
-
-            prevSet = filteredDataset
-            filteredDataset = filteredDataset.loc[ 
-                ( filteredDataset[ filterInput ] > filterHighLimit ) &
-                ( filteredDataset[ filterInput ] < filterLowLimit ) ]
-            emptyFlag = filteredDataset.empty
-
-            if ( not emptyFlag ):
-                print( filteredDataset )
-
-            else:
-                print( "This returns an empty Data Set " )
-
-                resetInput = int( input( 
-                    "0 to continue, 1 to reset last filter, 2 to reset all filters" ) )
-
-                if ( resetInput == 1 ):
-                    filteredDataset = prevSet
-                    emptyFlag = False
-                    continueFlag = True
-
-                if ( resetInput == 2 ):
-                    filteredDataset = dataset
-                    emptyFlag = False
-                    continueFlag = True
+    # filtering individual attributes is done with --query, or on a saved matrix
+    # ( --store ) with sigmaStore.py, so thresholds can be tried without rerunning
 
     # prompt for inspecting specific asteroid after running program on multiple
     # if ( input( "Inspect Specific Asteroid( y/n ): " ) == "y" ):
@@ -739,13 +1180,30 @@ def runProgram( maxIn, offset, exportFlg, exportArgs, fltrType, fltrLvl, plots )
 ### Use: Allows user to specific the name ( numerical 'ssnamenr' from database ) of an
 ### asteroid they wish to analyze more in depth than in runProgram. 
 ########################################################################################
-def viewOne( astArgs, exportFlg, exportArgs, fltrType, fltrLvl, plots ):
+def viewOne( astArgs, exportFlg, exportArgs, fltrType, fltrLvl, plots, opts=defaultOpts ):
+    # scored with the run's own --features and --bands ( see withRunLayout )
+    return withRunLayout( opts, inspectAsteroid, astArgs, exportFlg, exportArgs, fltrType, fltrLvl, plots, opts )
+
+# inspectAsteroid: viewOne's body, run once the feature set and bands are set
+def inspectAsteroid( astArgs, exportFlg, exportArgs, fltrType, fltrLvl, plots, opts=defaultOpts ):
     astName = astArgs[ 0 ]
     featFltr = astArgs[ 1 ]
     lB = astArgs[ 2 ]
     uB = astArgs[ 3 ]
     fltr = [ fltrType, fltrLvl ]
-    asteroid = pd.DataFrame( mag18Database.find( { "ssnamenr": int( astName ) } ).sort( "jd" ) )
+    if not canRate( fltrType ):
+        return
+    columns = neededCols( fltrType, plots, featFltr, viewOne=True )
+    if opts[ "cache" ]:
+        cached = obsCache.readAsteroids( opts[ "cache" ], [ astName ], columns )
+        if int( astName ) not in cached:
+            print( "ERROR: asteroid " + str( astName ) + " is not in the cache" )
+            return
+        asteroid = cached[ int( astName ) ]
+    else:
+        mag18Database = snapsDB.getCollection( mag18Name )
+        asteroid = pd.DataFrame( mag18Database.find( { "ssnamenr": int( astName ) },
+                                                     toProjection( columns ) ).sort( "jd" ) )
 
     # menu2Dict = { 0: 'Inspect Asteroid ' + str( astName ) + ":",
     #              1: 'View asteroid data',
@@ -764,26 +1222,26 @@ def viewOne( astArgs, exportFlg, exportArgs, fltrType, fltrLvl, plots ):
     
     if menu2Choice == 1:
         print( "Asteroid " + str( astName ) + " Stats:\n" )
-        astSigmaMatrix = np.zeros( [ 1, numFeatures + 2 ] )
-        obsData = [ ]
-        sigmaMatrix, obsData, outliers = fillSigmaMatrix( astName, asteroid, astSigmaMatrix, fltr, True, plots, exportFlg )
-        if len( sigmaMatrix ) == 0:
+        results = newResults( [ int( astName ) ] )
+        fillSigmaMatrix( astName, asteroid, results[ 0 ], fltr, plots, exportFlg, opts )
+        if fltrType == 3:
+            filterByWeight( results, fltrLvl, filterWeights( opts ) )
+        if not results[ "kept" ][ 0 ]:
             print( "ERROR: Your chosen filter level yielded an empty matrix!" )
-            antIDS.clear( )
             # viewOne( )
             # THIS FUNCTIONALITY IS DEPRECATED
 
         #breakpoint( )
-        table = formatDataTable( sigmaMatrix, antIDS, [ astName ], 1, numFeatures )
-        astRating = float( table[ "Rating" ] )
-
-        # reset antIDS for reruns of program
-        ### ERROR: This works for the most part, but still errors out upon quitting
-        ### the program - not sure why
-        antIDS.clear( )
+        table = formatDataTable( results, coincidence=( fltrType == 1 ), weighted=( fltrType == 3 ) )
+        astRating = float( table[ "Rating" ].iloc[ 0 ] )
+        obsData = results[ "jd" ][ 0 ]
+        outliers = results[ "outlier" ][ 0 ]
+        astIDs = results[ "id" ][ 0 ]
 
         print( table.transpose( ) )
         print( "\n\n" )
+        featStats = sigmaEngine.featureMoments( asteroid, wantedAttrs )
+        stdevs = np.sqrt( featStats[ "var" ] )
 
         displayAll = False # hardcoded for testing purposes - move this to shell later! 
         if ( displayAll ):
@@ -792,39 +1250,16 @@ def viewOne( astArgs, exportFlg, exportArgs, fltrType, fltrLvl, plots ):
             print( "Asteroid Rating: " + str( round( astRating, 2 ) ) + "%" )
             print( "\n" )
 
-            print( "ELONG:" )
-            print( "    Sigma: ............. " + str( float( table[ "elong" ] ) ) )
-            print( "    Outlier Value: ..... " + str( outliers[ 0 ] ) )
-            print( "    Std Dev: ........... " + str( stat.stdev( asteroid[ "elong" ] ) ) )
-            print( "    Mean: .............. " + str( stat.mean( asteroid[ "elong" ] ) ) )
-            print( "    JD: ................ " + str( int( obsData[ 0 ] ) ) )
-            print( "    ZTF ID: ............ " + str( antIDS[ 0 ] ) )
-
-            print( "RB:" )
-            print( "    Sigma: ............. " + str( float( table[ "rb" ] ) ) )
-            print( "    Outlier Value: ..... " + str( outliers[ 1 ] ) )
-            print( "    Std Dev: ........... " + str( stat.stdev( asteroid[ "rb" ] ) ) )
-            print( "    Mean: .............. " + str( stat.mean( asteroid[ "rb" ] ) ) )
-            print( "    JD: ................ " + str( int( obsData[ 1 ] ) ) )
-            print( "    ZTF ID: ............ " + str( antIDS[ 1 ] ) )            
-
-            print( "H:" )
-            print( "    Sigma: ............. " + str( float( table[ "H" ] ) ) )
-            print( "    Outlier Value: ..... " + str( outliers[ 2 ] ) )
-            print( "    Std Dev: ........... " + str( stat.stdev( asteroid[ "H" ] ) ) )
-            print( "    Mean: .............. " + str( stat.mean( asteroid[ "H" ] ) ) ) 
-            print( "    JD: ................ " + str( int( obsData[ 2 ] ) ) )
-            print( "    ZTF ID: ............ " + str( antIDS[ 2 ] ) )            
-
-            print( "MAG18:" )
-            print( "    Sigma: ............. " + str( float( table[ "mag18omag8" ] ) ) )
-            print( "    Outlier Value: ..... " + str( outliers[ 3 ] ) )
-            print( "    Std Dev: ........... " + str( stat.stdev( asteroid[ "mag18omag8" ] ) ) )
-            print( "    Mean: .............. " + str( stat.mean( asteroid[ "mag18omag8" ] ) ) )
-            print( "    JD: ................ " + str( int( obsData[ 3 ] ) ) )
-            print( "    ZTF ID: ............ " + str( antIDS[ 3 ] ) )                            
+            for featNum, feature in enumerate( wantedAttrs ):
+                print( feature.upper( ) + ":" )
+                print( "    Sigma: ............. " + str( float( table[ feature ].iloc[ 0 ] ) ) )
+                print( "    Outlier Value: ..... " + str( outliers[ featNum ] ) )
+                print( "    Std Dev: ........... " + str( stdevs[ featNum ] ) )
+                print( "    Mean: .............. " + str( featStats[ "mean" ][ featNum ] ) )
+                print( "    JD: ................ " + str( int( obsData[ featNum ] ) ) )
+                print( "    ZTF ID: ............ " + str( astIDs[ featNum ] ) )
             print( "\n\n" )
-            print( asteroid[ [ "jd", "elong", "H", "rb", "mag18omag8", "fid" ] ] )
+            print( asteroid[ [ "jd" ] + wantedAttrs + [ "fid" ] ] )
 
 
 
@@ -854,42 +1289,49 @@ def viewOne( astArgs, exportFlg, exportArgs, fltrType, fltrLvl, plots ):
 
 
             
+        # the plots below are drawn for the default features
+        plotAttrs = [ "elong", "rb", "H", "mag18omag8" ]
+        if not all( feature in wantedAttrs for feature in plotAttrs ):
+            print( "WARNING: the asteroid data plots need " + ", ".join( plotAttrs ) + " in --features, skipping them" )
+            return
+        elongNum, rbNum, hNum, mag18Num = [ wantedAttrs.index( feature ) for feature in plotAttrs ]
+
         # setup for printing all plots later...
         astDataFigs, ( ( plt3, plt2 ), ( plt1, plt4 ) ) = plt.subplots( 2, 2, figsize=( 15,15 ) )
         astDataFigs.suptitle( "Asteroid " + str( astName ) )
 
         # rb vs. Julian Date scatterplot
         plt1.scatter( asteroid[ "jd" ], asteroid[ 'rb' ], color = 'deeppink' )
-        outlierRB = ( asteroid[ asteroid[ "rb" ] == outliers[ 1 ] ] ).index
+        outlierRB = ( asteroid[ asteroid[ "rb" ] == outliers[ rbNum ] ] ).index
         plt1.scatter( asteroid[ "jd" ][ outlierRB ],
                      asteroid[ "rb" ][ outlierRB ],
                      color = 'white',
                      marker = "." )
-        plt1.annotate( '%s' % obsData[ 1 ],
+        plt1.annotate( '%s' % obsData[ rbNum ],
                       xy = ( asteroid[ "jd" ][ outlierRB ],
                             asteroid[ "rb" ][ outlierRB ] ) )
         plt1.set( xlabel = "jd", ylabel = "rb" )
 
         # mag18omag8 vs. Julian Date scatterplot
         plt2.scatter( asteroid[ "jd" ], asteroid[ 'mag18omag8' ], color = 'gold' )
-        outlierMAG18 = ( asteroid[ asteroid[ "mag18omag8" ] == outliers[ 3 ] ] ).index
+        outlierMAG18 = ( asteroid[ asteroid[ "mag18omag8" ] == outliers[ mag18Num ] ] ).index
         plt2.scatter( asteroid[ "jd" ][ outlierMAG18 ],
                      asteroid[ "mag18omag8" ][ outlierMAG18 ],
                      color = 'white',
                      marker = "." )
-        plt2.annotate( '%s' % obsData[ 3 ],
+        plt2.annotate( '%s' % obsData[ mag18Num ],
                       xy = ( asteroid[ "jd" ][ outlierMAG18 ],
                             asteroid[ "mag18omag8" ][ outlierMAG18 ] ) )
         plt2.set( xlabel = "jd", ylabel = "mag18omag8" )
 
         # elong vs. Julian Date scatterplot
         plt3.scatter( asteroid[ "jd" ], asteroid[ 'elong' ], color = 'blue' )
-        outlierELONG = ( asteroid[ asteroid[ "elong" ] == outliers[ 0 ] ] ).index
+        outlierELONG = ( asteroid[ asteroid[ "elong" ] == outliers[ elongNum ] ] ).index
         plt3.scatter( asteroid[ "jd" ][ outlierELONG ],
                      asteroid[ "elong" ][ outlierELONG ],
                      color = "white",
                      marker = "." )
-        plt3.annotate( '%s' % obsData[ 0 ],
+        plt3.annotate( '%s' % obsData[ elongNum ],
                       xy = ( asteroid[ "jd" ][ outlierELONG ],
                             asteroid[ "elong" ][ outlierELONG ] ) )
         plt3.set( xlabel = "jd", ylabel = "elong" )
@@ -899,7 +1341,7 @@ def viewOne( astArgs, exportFlg, exportArgs, fltrType, fltrLvl, plots ):
         fidFiltered = asteroid.loc[ ( asteroid[ "fid" ] == 1 ) ]
         # print(fidFiltered)
         plt4.scatter( fidFiltered[ "jd" ], fidFiltered[ 'H' ], color = 'green' )
-        outlierH = ( asteroid[ asteroid[ "H" ] == outliers[ 2 ] ] ).index
+        outlierH = ( asteroid[ asteroid[ "H" ] == outliers[ hNum ] ] ).index
         # print(outlierH)
         fidFiltered = asteroid.loc[ ( asteroid[ "fid" ] == 2 ) ]
         # print(fidFiltered)
@@ -908,7 +1350,7 @@ def viewOne( astArgs, exportFlg, exportArgs, fltrType, fltrLvl, plots ):
                      asteroid[ "H" ][ outlierH ],
                      color = "white",
                      marker = "." )
-        plt4.annotate( '%s' % obsData[ 2 ],
+        plt4.annotate( '%s' % obsData[ hNum ],
                       xy = ( asteroid[ "jd" ][ outlierH ],
                             asteroid[ "H" ][ outlierH ] ) )
         plt4.set( xlabel = "jd", ylabel = "H" )
@@ -1190,13 +1632,14 @@ def plot3Dand2D( astName, xdata, ydata, zdata,
 ### and export data on asteroids pulled from the mongo database.
 ########################################################################################
 def main( ):
-    maxIn = int( sys.argv[ 1 ] )
-    offset = int( sys.argv[ 2 ] )
-    fltrType = int( sys.argv[ 3 ] )
-    fltrLvl = int( sys.argv[ 4 ] )
-    plots = sys.argv[ 5 ]
-    exportFlg = sys.argv[ 6 ]
-    # wantedAttrs = sys.argv[ 7 ]
+    argv, opts = getOptions( sys.argv )
+    maxIn = int( argv[ 1 ] )
+    offset = int( argv[ 2 ] )
+    fltrType = int( argv[ 3 ] )
+    fltrLvl = float( argv[ 4 ] )
+    plots = argv[ 5 ]
+    exportFlg = argv[ 6 ]
+    # wantedAttrs = argv[ 7 ]
     
     # defaults of these for the versions that don't set them themselves
     exportArgs = [2, ""]
@@ -1207,31 +1650,35 @@ def main( ):
     plots = [ False, True ][ plots.lower()[0] == "t" ]
 
     print(exportFlg)
-    if len(sys.argv) <= 7:
+    if len(argv) <= 7:
         pass
         # exportArgs = [ 2, "" ]
         # astArgs = [ 0, 'n', 0, 0 ]
     else:
         help()
         if exportFlg:
-            exportArgs = [ int( sys.argv[ 7 ] ),
-                           sys.argv[ 8 ] ]
+            exportArgs = [ int( argv[ 7 ] ),
+                           argv[ 8 ] ]
             if maxIn == 1:
-                astArgs = [ int( sys.argv[ 9 ] ),
-                            sys.argv[ 10 ],
-                            int( sys.argv[ 11 ] ),
-                            int( sys.argv[ 12 ] ) ]
+                astArgs = [ int( argv[ 9 ] ),
+                            argv[ 10 ],
+                            int( argv[ 11 ] ),
+                            int( argv[ 12 ] ) ]
         else:
-            astArgs = [ int( sys.argv[ 7 ] ),
-                        sys.argv[ 8 ],
-                        int( sys.argv[ 9 ] ),
-                        int( sys.argv[ 10 ] ) ]
+            astArgs = [ int( argv[ 7 ] ),
+                        argv[ 8 ],
+                        int( argv[ 9 ] ),
+                        int( argv[ 10 ] ) ]
     
+    if opts[ "cache" ] and opts[ "cacheSync" ]:
+        obsCache.syncCache( snapsDB.getCollection( mag18Name ), opts[ "cache" ] )
+
     if maxIn == 1:
-        viewOne( astArgs, exportFlg, exportArgs, fltrType, fltrLvl, plots )
+        viewOne( astArgs, exportFlg, exportArgs, fltrType, fltrLvl, plots, opts )
     else:
-        runProgram( maxIn, offset, exportFlg, exportArgs, fltrType, fltrLvl, plots )
+        runProgram( maxIn, offset, exportFlg, exportArgs, fltrType, fltrLvl, plots, opts )
 
 ## Run the program #####################################################################
-main( )
-leave( )
+if __name__ == "__main__":
+    main( )
+    leave( )
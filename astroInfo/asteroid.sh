@@ -29,6 +29,14 @@ featFltr=n # default n
 lB=0 # default 0
 uB=0 # default 0
 
+# optional flags (passed as --flag value):
+batchSize=500 # asteroids per database query, default 500
+cacheDir="" # local observation cache, default "" (read from MongoDB)
+workers=1 # parallel worker processes, default 1 (match --cpus-per-task above)
+stateDir="sigmaState" # incremental sigma state directory (sigmaState.py)
+storeDir="sigmaStore" # saved sigma matrix for sigmaStore.py queries
+query="elong > 3 and abs(rb) < 2" # expression to filter the saved matrix by
+
 
 
 # PRE-RUN CLEANUP
@@ -44,14 +52,22 @@ uB=0 # default 0
 
 # RUNNING -----------------------------------------
 # No export, multiple asteroids
-# time python 2astOutlierMatNew.py "$maxIn" "$offset" "$fltrType" "$fltrLvl" "$plots" "$exportFlg"
+# time python 2astOutlierMatNew.py "$maxIn" "$offset" "$fltrType" "$fltrLvl" "$plots" "$exportFlg" --batchSize "$batchSize" --cache "$cacheDir" --workers "$workers"
 
 # Export multiple asteroids
-# time python 2astOutlierMatNew.py "$maxIn" "$offset" "$fltrType" "$fltrLvl" "$plots" "$exportFlg" "$fileType" "$fileName"
+# time python 2astOutlierMatNew.py "$maxIn" "$offset" "$fltrType" "$fltrLvl" "$plots" "$exportFlg" "$fileType" "$fileName" --batchSize "$batchSize" --cache "$cacheDir" --workers "$workers"
 
 # No export, single asteroid
 time python 2astOutlierMatNew.py "$maxIn" "$offset" "$fltrType" "$fltrLvl" "$plots" "$exportFlg" "$astName" "$featFltr" "$lB" "$uB"
 
+# Build the sigma matrix once (no filter), then query it as often as needed
+# time python 2astOutlierMatNew.py "$maxIn" "$offset" 4 0 False False --batchSize "$batchSize" --cache "$cacheDir" --workers "$workers" --store "$storeDir"
+# time python sigmaStore.py query "$storeDir" "$query"
+
+# Nightly sigma state refresh (folds in only observations newer than the last update)
+# time python sigmaState.py update "$stateDir" --cache "$cacheDir"
+# time python sigmaState.py export "$stateDir" "$fileType" "$fileName"
+
 # Export single asteroid
 # time python 2astOutlierMatNew.py "$maxIn" "$offset" "$fltrType" "$fltrLvl" "$plots" "$exportFlg" "$fileType" "$fileName" "$astName" "$featFltr" "$lB" "$uB"
 
@@ -0,0 +1,157 @@
+#########################################################################################
+### Program: SNAPS Index Advisor
+### Last Update: 10.18.2026
+#########################################################################################
+# Maintenance command that checks the MongoDB indexes behind the queries SNAPS
+# issues. For each query pattern it runs an explain and reports whether the winning
+# plan is a covered index scan, an index scan plus fetch, or a full collection scan,
+# and whether it sorts in memory ( a blocking SORT stage instead of reading an
+# index in order ), and lists the recommended indexes that don't exist yet. With "create" it also
+# builds the missing ones. Indexes only the scripts in oldFiles/ would use ( they
+# sort one asteroid by a feature on the server ) are reported but never created.
+#
+# Usage:
+#     python indexAdvisor.py          report only
+#     python indexAdvisor.py create   report, then create the missing recommended indexes
+
+## IMPORTS ##############################################################################
+import sys
+import snapsDB
+
+## GLOBAL VARS ##########################################################################
+# features the scripts in oldFiles/ sort by server-side ( e.g. buildCSV.py ); the
+# current code finds each feature's extremes in memory and never sorts by them
+sortedFeatures = [ "elong", "rb", "H", "mag18omag8" ]
+
+# indexes the SNAPS queries rely on, as ( collection, key pattern, reason )
+wantedIndexes = [
+    ( "mag18o8", [ ( "ssnamenr", 1 ), ( "jd", 1 ) ],
+      "ssnamenr equality / $in batches, sorted by jd ( runProgram, viewOne )" ),
+    ( "mag18o8", [ ( "jd", 1 ) ],
+      "jd range for incremental cache syncs and sigma state updates" )
+]
+
+# indexes only oldFiles/ scripts would use, reported but never created: each one
+# is a full extra index on mag18o8 for queries the current code doesn't send
+oldFileIndexes = [ ( "mag18o8", [ ( "ssnamenr", 1 ), ( feature, 1 ) ],
+                     "one asteroid sorted by " + feature + " without an in-memory sort ( oldFiles/ only )" )
+                   for feature in sortedFeatures ]
+
+## FUNCTION DEFINITIONS #################################################################
+
+# planStages: takes an explain plan stage and returns the names of every stage
+# under it, outermost first
+def planStages( stage ):
+    stages = [ stage.get( "stage", "?" ) ]
+    if "inputStage" in stage:
+        stages.extend( planStages( stage[ "inputStage" ] ) )
+    for child in stage.get( "inputStages", [ ] ):
+        stages.extend( planStages( child ) )
+    return stages
+
+# summarizePlan: takes a cursor, explains it and returns a one line summary:
+# the kind of scan, whether it sorts in memory, the stages and the keys /
+# documents examined
+def summarizePlan( cursor ):
+    explained = cursor.explain( )
+    winningPlan = explained[ "queryPlanner" ][ "winningPlan" ]
+    # servers using the slot based engine ( 7.0+ ) nest the plan one level down
+    stages = planStages( winningPlan.get( "queryPlan", winningPlan ) )
+    if "COLLSCAN" in stages:
+        scanType = "COLLECTION SCAN"
+    elif "FETCH" in stages:
+        scanType = "index scan + fetch"
+    else:
+        scanType = "covered index scan"
+    if "SORT" in stages:
+        # blocking: every matching document is read before the first is returned
+        scanType += " + IN-MEMORY SORT"
+
+    summary = scanType + " [" + " <- ".join( stages ) + "]"
+    stats = explained.get( "executionStats" )
+    if stats is not None:
+        summary += ( " keys examined: " + str( stats[ "totalKeysExamined" ] ) +
+                     ", docs examined: " + str( stats[ "totalDocsExamined" ] ) +
+                     ", returned: " + str( stats[ "nReturned" ] ) )
+    return summary
+
+# hasIndex: takes a collection and a key pattern, returns True if an existing
+# index starts with that pattern ( so it can serve the same queries )
+def hasIndex( collection, keys ):
+    for info in collection.index_information( ).values( ):
+        if list( info[ "key" ] )[ :len( keys ) ] == keys:
+            return True
+    return False
+
+# queryPatterns: takes a sample asteroid name and returns the queries SNAPS issues
+# as ( description, collection name, filter, projection, sort ) tuples
+def queryPatterns( name ):
+    obsCols = { "_id": 0, "ssnamenr": 1, "jd": 1, "id": 1, "elong": 1, "rb": 1,
+                "H": 1, "mag18omag8": 1 }
+    patterns = [
+        ( "one asteroid's observations", "mag18o8",
+          { "ssnamenr": name }, obsCols, None ),
+        ( "one asteroid sorted by jd ( viewOne )", "mag18o8",
+          { "ssnamenr": name }, obsCols, "jd" ),
+        ( "batch of asteroids ( $in )", "mag18o8",
+          { "ssnamenr": { "$in": [ name ] } }, obsCols, None ),
+        ( "observations after a jd ( cache sync )", "mag18o8",
+          { "jd": { "$gt": 1e10 } }, obsCols, None ),
+        # every name in collection order ( getAsteroidNames, obsCache.loadNameIndex ):
+        # a collection scan no index can replace without changing the order, which
+        # is why runs read the local name index instead
+        ( "asteroid names ( name index rebuild, --nameIndex '' )", "asteroids_all",
+          { }, { "_id": 0, "ssnamenr": 1 }, None )
+    ]
+    for feature in sortedFeatures:
+        patterns.append( ( "one asteroid sorted by " + feature + " ( oldFiles/ only )", "mag18o8",
+                           { "ssnamenr": name }, obsCols, feature ) )
+    return patterns
+
+# report: takes no inputs, prints an explain summary for every query pattern and
+# returns the recommended indexes that are missing
+def report( ):
+    sample = snapsDB.getCollection( "mag18o8" ).find_one( { }, { "_id": 0, "ssnamenr": 1 } )
+    if sample is None:
+        print( "mag18o8 is empty, nothing to check" )
+        return [ ]
+
+    print( "QUERY PLANS (sample asteroid " + str( sample[ "ssnamenr" ] ) + ")" )
+    for desc, collName, query, projection, sortKey in queryPatterns( sample[ "ssnamenr" ] ):
+        cursor = snapsDB.getCollection( collName ).find( query, projection )
+        if sortKey is not None:
+            cursor = cursor.sort( sortKey )
+        print( "  " + desc + ": " + summarizePlan( cursor ) )
+
+    print( "\nINDEXES" )
+    missing = [ ]
+    for collName, keys, reason in wantedIndexes:
+        found = hasIndex( snapsDB.getCollection( collName ), keys )
+        print( "  " + collName + " " + str( keys ) + ": " +
+               [ "MISSING", "ok" ][ found ] + " - " + reason )
+        if not found:
+            missing.append( ( collName, keys ) )
+    for collName, keys, reason in oldFileIndexes:
+        found = hasIndex( snapsDB.getCollection( collName ), keys )
+        print( "  " + collName + " " + str( keys ) + ": " +
+               [ "absent, not created", "ok" ][ found ] + " - " + reason )
+    return missing
+
+# createIndexes: takes the list of missing indexes and builds each one
+def createIndexes( missing ):
+    for collName, keys in missing:
+        print( "Creating " + collName + " " + str( keys ) + "..." )
+        snapsDB.getCollection( collName ).create_index( keys )
+
+def main( ):
+    create = len( sys.argv ) > 1 and sys.argv[ 1 ] == "create"
+    missing = report( )
+    if missing and create:
+        createIndexes( missing )
+        print( "\nAfter creating indexes:" )
+        report( )
+    elif missing:
+        print( "\nRun 'python indexAdvisor.py create' to build the missing indexes." )
+
+if __name__ == "__main__":
+    main( )
@@ -0,0 +1,291 @@
+#########################################################################################
+### Program: SNAPS Local Observation Cache
+### Last Update: 10.18.2026
+#########################################################################################
+# Keeps a local on-disk copy of the mag18o8 collection so repeat runs don't have to
+# pull the same observations over the network again. Every column is stored as its
+# own .npy file, all sorted by ( ssnamenr, jd ), so readers only touch the columns
+# they need and each asteroid is one contiguous block of rows. A sync only pulls
+# observations with a jd newer than the newest one already cached.
+#
+# Columns are opened memory-mapped, so an asteroid's observations are zero-copy
+# slices found through a CSR-style offset index ( rows offsets[ i ]:offsets[ i + 1 ]
+# belong to names[ i ] ), and worker processes on one node share the same
+# page-cached copy of the data instead of each loading their own.
+#
+# Cache directory layout:
+#     meta.json              columns, number of rows, the last jd synced and the
+#                            generation holding them
+#     gen-N/<column>.npy     one array per column
+#     gen-N/index-names.npy  sorted unique ssnamenr values
+#     gen-N/index-offsets.npy  first row of each asteroid, plus the total row count
+#
+# A sync writes every file into a new gen-N directory and only then points
+# meta.json at it ( see saveGeneration ), so all columns always come from the
+# same sync, even if one crashes halfway.
+#
+# The list of asteroid names ( asteroids_all ) is kept the same way in its own small
+# index file, so picking an offset, a random start or the whole catalog doesn't
+# need a scan of the collection on every run.
+
+## IMPORTS ##############################################################################
+import os
+import json
+import shutil
+import numpy as np
+import pandas as pd
+
+## GLOBAL VARS ##########################################################################
+metaFile = "meta.json"
+fetchSize = 100000 # documents converted to arrays at a time while syncing
+
+# every column of mag18o8 (same as attrList in 2astOutlierMatNew.py)
+cacheCols = [ "ssnamenr", "jd", "fid", "pid", "diffmaglim", "ra", "dec", "magpsf",
+              "sigmapsf", "chipsf", "magap", "sigmagap", "magapbig", "sigmagapbig",
+              "distnr", "magnr", "fwhm", "elong", "rb", "ssdistnr", "ssmagnr", "id",
+              "night", "phaseangle", "obsdist", "heliodist", "H", "ltc", "mag18omag8" ]
+
+loaded = { } # memory-mapped arrays already opened, keyed by ( generation directory, column )
+current = { } # generation directory each cache directory was read from, keyed by cacheDir
+nameIndexVersion = 1 # bump if the name index file layout changes
+
+## FUNCTION DEFINITIONS #################################################################
+
+# readMeta: takes the cache directory and returns its metadata dict, or None if
+# there is no cache there yet
+def readMeta( cacheDir ):
+    metaPath = os.path.join( cacheDir, metaFile )
+    if not os.path.exists( metaPath ):
+        return None
+    with open( metaPath, 'r' ) as file:
+        return json.load( file )
+
+# replaceFile: takes a file path and a function writing the file's contents to an
+# open binary file. Writes them under a temporary name and moves that over the
+# path in one step ( os.replace ), so readers see the old file or the new one,
+# never part of one
+def replaceFile( path, writeFn ):
+    tmpPath = path + ".tmp"
+    with open( tmpPath, 'wb' ) as file:
+        writeFn( file )
+    os.replace( tmpPath, path )
+
+# generationDir: takes a directory written by saveGeneration and its metadata,
+# returns the directory holding the files the metadata points to ( the directory
+# itself for ones written before generations, or with no metadata yet )
+def generationDir( baseDir, meta ):
+    if meta is None or "generation" not in meta:
+        return baseDir
+    return os.path.join( baseDir, "gen-" + str( meta[ "generation" ] ) )
+
+# saveGeneration: takes a directory, a dict of file name -> array and the
+# metadata. Writes the arrays into a new generation directory, then replaces
+# meta.json with the metadata pointing at it, the only step readers see: a crash
+# before it leaves the previous generation in use, whole. Older generations are
+# deleted once the switch is made. Returns the new generation's directory
+def saveGeneration( baseDir, arrays, meta ):
+    os.makedirs( baseDir, exist_ok=True )
+    oldMeta = readMeta( baseDir )
+    generation = oldMeta.get( "generation", 0 ) + 1 if oldMeta is not None else 1
+    genDir = generationDir( baseDir, { "generation": generation } )
+    shutil.rmtree( genDir, ignore_errors=True ) # left over by a crashed save
+    os.makedirs( genDir )
+    for name, values in arrays.items( ):
+        np.save( os.path.join( genDir, name + ".npy" ), values )
+
+    meta = dict( meta, generation=generation )
+    replaceFile( os.path.join( baseDir, metaFile ),
+                 lambda file: file.write( json.dumps( meta, indent=1 ).encode( ) ) )
+
+    for entry in os.listdir( baseDir ):
+        if entry.startswith( "gen-" ) and entry != os.path.basename( genDir ):
+            shutil.rmtree( os.path.join( baseDir, entry ), ignore_errors=True )
+    if oldMeta is not None and "generation" not in oldMeta:
+        # files of the layout before generations
+        for name in arrays:
+            if os.path.exists( os.path.join( baseDir, name + ".npy" ) ):
+                os.remove( os.path.join( baseDir, name + ".npy" ) )
+    return genDir
+
+# dataDir: takes the cache directory and returns the generation directory its
+# columns are read from, looked up once per run
+def dataDir( cacheDir ):
+    if cacheDir not in current:
+        current[ cacheDir ] = generationDir( cacheDir, readMeta( cacheDir ) )
+    return current[ cacheDir ]
+
+# toColumns: takes a list of mongo documents and the columns to keep, returns a
+# dict of column -> numpy array. Strings are stored fixed width (never as python
+# objects) so the files can be loaded without pickle
+def toColumns( docs, columns ):
+    frame = pd.DataFrame( docs, columns=columns )
+    arrays = { }
+    for col in columns:
+        values = frame[ col ].to_numpy( )
+        if values.dtype == object:
+            values = values.astype( str )
+        arrays[ col ] = values
+    return arrays
+
+# findColumns: takes a collection, a query and the columns to keep. Yields the
+# matching documents as dicts of column arrays ( see toColumns ), converted
+# fetchSize documents at a time to keep memory down
+def findColumns( collection, query, columns ):
+    projection = { "_id": 0 }
+    for col in columns:
+        projection[ col ] = 1
+    docs = [ ]
+    for doc in collection.find( query, projection ).batch_size( fetchSize ):
+        docs.append( doc )
+        if len( docs ) == fetchSize:
+            yield toColumns( docs, columns )
+            docs = [ ]
+    if len( docs ) != 0:
+        yield toColumns( docs, columns )
+
+# loadColumn: takes the cache directory and a column name, returns that column's
+# array memory-mapped read-only. Each column is only opened once per run
+def loadColumn( cacheDir, col ):
+    key = ( dataDir( cacheDir ), col )
+    if key not in loaded:
+        colPath = os.path.join( key[ 0 ], col + ".npy" )
+        if not os.path.exists( colPath ):
+            raise KeyError( "column " + col + " is not in the cache at " + cacheDir )
+        loaded[ key ] = np.load( colPath, mmap_mode='r' )
+    return loaded[ key ]
+
+# buildIndex: takes the sorted ssnamenr column and returns the unique asteroid
+# names and the offset of each one's first row ( plus the total row count )
+def buildIndex( astNames ):
+    names, starts = np.unique( astNames, return_index=True )
+    offsets = np.append( starts, len( astNames ) ).astype( np.int64 )
+    return names, offsets
+
+# loadIndex: takes the cache directory and returns the names and offsets arrays,
+# building and saving them first for caches written before the index existed
+def loadIndex( cacheDir ):
+    if not os.path.exists( os.path.join( dataDir( cacheDir ), "index-offsets.npy" ) ):
+        names, offsets = buildIndex( loadColumn( cacheDir, "ssnamenr" ) )
+        replaceFile( os.path.join( dataDir( cacheDir ), "index-names.npy" ), lambda file: np.save( file, names ) )
+        replaceFile( os.path.join( dataDir( cacheDir ), "index-offsets.npy" ), lambda file: np.save( file, offsets ) )
+    return loadColumn( cacheDir, "index-names" ), loadColumn( cacheDir, "index-offsets" )
+
+# astRows: takes the cache directory and an asteroid name, returns the ( start,
+# stop ) rows holding that asteroid's observations, or None if it isn't cached
+def astRows( cacheDir, name ):
+    names, offsets = loadIndex( cacheDir )
+    pos = np.searchsorted( names, int( name ) )
+    if pos == len( names ) or names[ pos ] != int( name ):
+        return None
+    return int( offsets[ pos ] ), int( offsets[ pos + 1 ] )
+
+# saveColumns: takes the cache directory, a dict of column arrays and the
+# metadata, and writes them out as the cache's next generation ( see
+# saveGeneration ), so a crashed sync leaves the old cache usable
+def saveColumns( cacheDir, arrays, meta ):
+    oldDir = dataDir( cacheDir )
+    current[ cacheDir ] = saveGeneration( cacheDir, arrays, meta )
+    for key in [ key for key in loaded if key[ 0 ] == oldDir ]:
+        del loaded[ key ]
+
+# syncCache: takes the mag18o8 collection, the cache directory and the columns to
+# keep (only used when the cache is first built). Pulls only the observations with
+# a jd newer than the last sync, merges them into the cached columns and rewrites
+# them sorted by ( ssnamenr, jd ). Returns the number of new observations
+def syncCache( collection, cacheDir, columns=cacheCols ):
+    os.makedirs( cacheDir, exist_ok=True )
+    meta = readMeta( cacheDir )
+    query = { }
+    if meta is not None:
+        columns = meta[ "columns" ]
+        query = { "jd": { "$gt": meta[ "lastJd" ] } }
+    for col in [ "ssnamenr", "jd" ]:
+        if col not in columns:
+            columns = [ col ] + list( columns )
+
+    chunks = list( findColumns( collection, query, columns ) )
+    newRows = sum( len( chunk[ "jd" ] ) for chunk in chunks )
+    if newRows == 0:
+        print( "Cache at " + cacheDir + " is up to date" )
+        return 0
+
+    if meta is not None:
+        chunks.insert( 0, { col: loadColumn( cacheDir, col ) for col in columns } )
+
+    merged = { }
+    for col in columns:
+        merged[ col ] = np.concatenate( [ chunk[ col ] for chunk in chunks ] )
+    order = np.lexsort( ( merged[ "jd" ], merged[ "ssnamenr" ] ) )
+    for col in columns:
+        merged[ col ] = merged[ col ][ order ]
+    merged[ "index-names" ], merged[ "index-offsets" ] = buildIndex( merged[ "ssnamenr" ] )
+
+    meta = { "columns": list( columns ),
+             "nRows": int( len( order ) ),
+             "lastJd": float( np.nanmax( merged[ "jd" ] ) ) }
+    saveColumns( cacheDir, merged, meta )
+    print( "Cache at " + cacheDir + ": added " + str( newRows ) + " observations" )
+    return newRows
+
+# readSlices: takes the cache directory, a list of asteroid names and the columns
+# wanted (None for every cached column). Returns a dict of name -> { column: array }
+# where every array is a zero-copy slice of the memory-mapped column, sorted by jd
+def readSlices( cacheDir, names, columns=None ):
+    if columns is None:
+        columns = readMeta( cacheDir )[ "columns" ]
+    colArrays = { col: loadColumn( cacheDir, col ) for col in columns }
+    astSlices = { }
+    for name in names:
+        rows = astRows( cacheDir, name )
+        if rows is None:
+            continue
+        start, stop = rows
+        astSlices[ int( name ) ] = { col: colArrays[ col ][ start:stop ] for col in columns }
+    return astSlices
+
+# readAsteroids: same as readSlices but wraps each asteroid in a DataFrame, the
+# same shape fetchBatch returns, for code that needs pandas ( plots, viewOne )
+def readAsteroids( cacheDir, names, columns=None ):
+    astFrames = { }
+    for name, astSlice in readSlices( cacheDir, names, columns ).items( ):
+        astFrames[ name ] = pd.DataFrame( astSlice )
+    return astFrames
+
+# loadNameIndex: takes the name index path ( without extension ) and, optionally,
+# the asteroids_all collection. Returns every asteroid name as an int64 array in
+# collection order. The names are only read from the database again when there is
+# no index yet, it was written by an older layout, or the collection's document
+# count has changed. Without a collection the stored index is used as is
+def loadNameIndex( indexPath, collection=None ):
+    meta = None
+    if os.path.exists( indexPath + ".json" ):
+        with open( indexPath + ".json", 'r' ) as file:
+            meta = json.load( file )
+
+    if meta is not None and meta[ "version" ] == nameIndexVersion:
+        # estimated_document_count only reads collection metadata, no scan
+        if collection is None or collection.estimated_document_count( ) == meta[ "count" ]:
+            return np.load( indexPath + ".npy" )
+
+    if collection is None:
+        raise FileNotFoundError( "no asteroid name index at " + indexPath )
+
+    print( "Rebuilding asteroid name index at " + indexPath )
+    cursor = collection.find( { }, { "_id": 0, "ssnamenr": 1 } )
+    names = np.fromiter( ( doc[ "ssnamenr" ] for doc in cursor ), dtype=np.int64 )
+    saveNameIndex( indexPath, names )
+    return names
+
+# saveNameIndex: takes the name index path ( without extension ) and the names,
+# and writes the index with its count and layout version. Each file is replaced
+# in one step ( see replaceFile ) and the names go first, so a run started
+# alongside ( e.g. another task of asteroid.sh ) never reads half a file, and
+# the count it checks is never newer than the names
+def saveNameIndex( indexPath, names ):
+    indexDir = os.path.dirname( indexPath )
+    if indexDir:
+        os.makedirs( indexDir, exist_ok=True )
+    names = np.asarray( names, dtype=np.int64 )
+    replaceFile( indexPath + ".npy", lambda file: np.save( file, names ) )
+    replaceFile( indexPath + ".json",
+                 lambda file: file.write( json.dumps( { "version": nameIndexVersion, "count": int( len( names ) ) } ).encode( ) ) )
@@ -0,0 +1,537 @@
+#########################################################################################
+### Program: SNAPS Vectorized Sigma Engine
+### Last Update: 10.18.2026
+#########################################################################################
+# Computes the sigma matrix for a whole block of asteroids at once instead of looping
+# over asteroids and features in python. A block holds every observation of its
+# asteroids as flat column arrays, one asteroid after another, with CSR-style
+# offsets: rows offsets[ i ]:offsets[ i + 1 ] belong to names[ i ] ( the same layout
+# as the local observation cache ). Per-asteroid statistics are then segmented
+# numpy reductions ( np.add.reduceat and friends ) over those rows, a handful of
+# vectorized passes per feature no matter how many asteroids are in the block.
+
+## IMPORTS ##############################################################################
+import numpy as np
+
+## FUNCTION DEFINITIONS #################################################################
+
+# toBlock: takes a fetched batch ( name -> DataFrame or dict of arrays ), the names
+# to include in order and the columns wanted. Returns a block dict with "names",
+# "offsets" and "cols" ( column -> flat array ). Names must all be in the batch
+def toBlock( batch, names, columns ):
+    counts = [ len( batch[ int( name ) ][ "jd" ] ) for name in names ]
+    offsets = np.zeros( len( names ) + 1, dtype=np.int64 )
+    offsets[ 1: ] = np.cumsum( counts )
+    cols = { }
+    for col in columns:
+        cols[ col ] = np.concatenate( [ np.asarray( batch[ int( name ) ][ col ] ) for name in names ] )
+    return { "names": np.array( [ int( name ) for name in names ] ),
+             "offsets": offsets,
+             "cols": cols }
+
+# segmentArgs: takes flat values, the block offsets and the per-segment target
+# values ( e.g. each segment's min ), returns the global row of the first value in
+# each segment equal to its target
+def segmentArgs( values, offsets, targets ):
+    counts = np.diff( offsets )
+    rows = np.arange( len( values ) )
+    hits = np.where( values == np.repeat( targets, counts ), rows, len( values ) )
+    return np.minimum.reduceat( hits, offsets[ :-1 ] )
+
+# segmentMoments: takes flat values and the block offsets, returns per-segment
+# count, mean, M2 ( sum of squared differences from the mean ), min, max and the
+# global rows of the min and max, skipping NaNs like moments does. A segment with
+# no values gets count 0, nan statistics and rows of -1. M2 is what lets two
+# sets of moments be merged later ( see mergeMoments )
+def segmentMoments( values, offsets ):
+    values = np.asarray( values, dtype=np.float64 )
+    starts = offsets[ :-1 ]
+    counts = np.diff( offsets )
+    missing = np.isnan( values )
+    count = np.add.reduceat( ( ~missing ).astype( np.int64 ), starts )
+    with np.errstate( divide='ignore', invalid='ignore' ):
+        mean = np.add.reduceat( np.where( missing, 0, values ), starts ) / count
+        centered = np.where( missing, 0, values - np.repeat( mean, counts ) )
+    m2 = np.add.reduceat( centered * centered, starts )
+    minVal = np.minimum.reduceat( np.where( missing, np.inf, values ), starts )
+    maxVal = np.maximum.reduceat( np.where( missing, -np.inf, values ), starts )
+    empty = count == 0
+    return { "count": count,
+             "mean": np.where( empty, np.nan, mean ),
+             "m2": np.where( empty, np.nan, m2 ),
+             "min": np.where( empty, np.nan, minVal ),
+             "max": np.where( empty, np.nan, maxVal ),
+             "argmin": np.where( empty, -1, segmentArgs( values, offsets, minVal ) ),
+             "argmax": np.where( empty, -1, segmentArgs( values, offsets, maxVal ) ) }
+
+# mergeMoments: takes two sets of counts, means and M2s ( arrays of the same
+# shape, e.g. what is stored and what just arrived ) and returns the count, mean
+# and M2 of both together ( Chan et al. pairwise update ), as if computed over
+# every value at once. Either side may have a count of 0
+def mergeMoments( countA, meanA, m2A, countB, meanB, m2B ):
+    count = countA + countB
+    with np.errstate( divide='ignore', invalid='ignore' ):
+        delta = meanB - meanA
+        mean = meanA + delta * countB / count
+        m2 = m2A + m2B + delta * delta * countA * countB / count
+    mean = np.where( countA == 0, meanB, np.where( countB == 0, meanA, mean ) )
+    m2 = np.where( countA == 0, m2B, np.where( countB == 0, m2A, m2 ) )
+    return count, mean, m2
+
+# pickSigmas: takes per-asteroid center ( mean or median ), scale ( sample stdev
+# or scaled MAD ), min and max of a feature and its weight. Returns ( useHigh,
+# sigma, absSigma ): whether the max is the bigger outlier, and its weighted sigma
+# signed ( negative below the center ) and absolute
+def pickSigmas( center, scale, minVal, maxVal, weight ):
+    with np.errstate( divide='ignore', invalid='ignore' ):
+        highSigma = ( maxVal - center ) / scale
+        lowSigma = ( center - minVal ) / scale
+    useHigh = highSigma > lowSigma
+    sigma = np.where( useHigh, highSigma, -lowSigma ) * weight
+    absSigma = np.where( useHigh, highSigma, lowSigma ) * weight
+    return useHigh, sigma, absSigma
+
+# moments: takes a 2D array ( observations x features ) and returns a dict of
+# per-feature count, mean, var ( sample ), min, max, argmin and argmax from one
+# pass over the data.
+#   NaNs are skipped explicitly: count is the number of non-NaN values and every
+#   other statistic only uses those. A feature with no values gets nan statistics
+#   and -1 for argmin / argmax, and one with fewer than 2 values gets a nan var
+#   ( statistics.stdev raises instead ).
+#   The sums are taken around a shift ( each feature's first non-NaN value ), so
+#   sum( d ) and sum( d^2 ) stay small and var = ( sum( d^2 ) - sum( d )^2 / n ) /
+#   ( n - 1 ) doesn't lose its digits to cancellation the way the textbook
+#   one-pass formula does. statistics.mean / stdev are exact ( fractions ) then
+#   rounded once; on SNAPS-like data ( spread small next to the magnitudes ) these
+#   agree with them to ~1e-15 relative ( a few ulps ), far below the 6 digits
+#   exported, so the sigma matrix comes out the same
+def moments( values ):
+    values = np.asarray( values, dtype=np.float64 )
+    if values.ndim == 1:
+        values = values[ :, None ]
+    missing = np.isnan( values )
+    count = ( ~missing ).sum( axis=0 )
+    hasValues = count > 0
+
+    firstRow = np.argmax( ~missing, axis=0 )
+    shift = np.where( hasValues, values[ firstRow, np.arange( values.shape[ 1 ] ) ], 0 )
+    diffs = np.where( missing, 0, values - shift )
+    sumDiff = diffs.sum( axis=0 )
+    sumSq = ( diffs * diffs ).sum( axis=0 )
+
+    with np.errstate( divide='ignore', invalid='ignore' ):
+        mean = np.where( hasValues, shift + sumDiff / count, np.nan )
+        var = np.where( count > 1, ( sumSq - sumDiff * sumDiff / count ) / ( count - 1 ), np.nan )
+    var = np.maximum( var, 0 ) # rounding can leave -0 or -1e-17 for constant data
+
+    argmin = np.where( missing, np.inf, values ).argmin( axis=0 )
+    argmax = np.where( missing, -np.inf, values ).argmax( axis=0 )
+    cols = np.arange( values.shape[ 1 ] )
+    return { "count": count,
+             "mean": mean,
+             "var": var,
+             "min": np.where( hasValues, values[ argmin, cols ], np.nan ),
+             "max": np.where( hasValues, values[ argmax, cols ], np.nan ),
+             "argmin": np.where( hasValues, argmin, -1 ),
+             "argmax": np.where( hasValues, argmax, -1 ) }
+
+# featureMoments: takes an asteroid ( DataFrame or dict of arrays ) and the
+# features wanted, returns moments over those columns ( indexed like features )
+def featureMoments( asteroid, features ):
+    return moments( np.column_stack( [ np.asarray( asteroid[ feature ], dtype=np.float64 )
+                                       for feature in features ] ) )
+
+# rateObservations: takes an asteroid's rating attributes ( observations x
+# attributes ), each attribute's direction ( 1: high values are anomalous, -1: low
+# values are ) and weight. Every attribute is min-max normalized to [ 0,1 ] in one
+# array operation, flipped where low is anomalous, and each observation's rating
+# is the weighted mean of those. An attribute with no spread gives nan ratings
+def rateObservations( values, directions, weights ):
+    values = np.asarray( values, dtype=np.float64 )
+    lows = np.nanmin( values, axis=0 )
+    highs = np.nanmax( values, axis=0 )
+    with np.errstate( divide='ignore', invalid='ignore' ):
+        normed = ( values - lows ) / ( highs - lows )
+    normed = np.where( np.asarray( directions ) < 0, 1 - normed, normed )
+    weights = np.asarray( weights, dtype=np.float64 )
+    return normed @ weights / weights.sum( )
+
+# rateAsteroid: same inputs as rateObservations, returns ( ratings, max rating
+# 0-100, index of the best rated observation ). The max skips nan ratings; if
+# every rating is nan the rating is nan and the index -1
+def rateAsteroid( values, directions, weights ):
+    ratings = rateObservations( values, directions, weights )
+    if np.isnan( ratings ).all( ):
+        return ratings, np.nan, -1
+    maxIndex = int( np.nanargmax( ratings ) )
+    return ratings, ratings[ maxIndex ] * 100, maxIndex
+
+# segmentSort: takes flat values and the block offsets, returns ( order, counts ):
+# the block's rows with each segment's rows sorted by value, NaNs last, and each
+# segment's number of non-NaN values. The value ranked r ( from 0, lowest first )
+# in segment i is at row order[ offsets[ i ] + r ]; equal values come in no
+# particular order. Sorts like np.lexsort( ( values, segIds ) ), but the
+# whole block is sorted by value once ( NaNs as +inf, argsort is several times
+# faster without them ) and then stably by segment, which keeps every segment's
+# values in order: with at most 65536 segments the ids fit uint16, which numpy
+# radix sorts in linear time. No python loop over segments or segment lengths
+def segmentSort( values, offsets ):
+    values = np.asarray( values, dtype=np.float64 )
+    numSeg = len( offsets ) - 1
+    segIds = np.repeat( np.arange( numSeg, dtype=np.uint16 if numSeg <= 65536 else np.int64 ),
+                        np.diff( offsets ) )
+    missing = np.isnan( values )
+    counts = np.diff( offsets )
+    if missing.any( ):
+        values = np.where( missing, np.inf, values )
+        counts = counts - np.bincount( segIds[ missing ], minlength=numSeg )
+    byValue = np.argsort( values )
+    order = byValue[ np.argsort( segIds[ byValue ], kind="stable" ) ]
+    return order, counts
+
+# rankRows: takes the order and offsets from segmentSort and each segment's
+# wanted ranks ( segments x ranks ), returns the rows at those ranks, clipped
+# into the block ( callers mask out ranks past a segment's values )
+def rankRows( order, offsets, ranks ):
+    return order[ np.clip( offsets[ :-1 ][ :, None ] + ranks, 0, len( order ) - 1 ) ]
+
+# madScale: MAD times this estimates the standard deviation of normal data, so
+# robust sigmas are on the same scale as mean / stdev ones
+madScale = 1.4826
+
+# segmentRobust: takes flat values and the block offsets, returns per-segment
+# median and scaled MAD ( median absolute deviation from the median ), NaNs
+# skipped. Both come from one sort ( see segmentSort ): the deviations, smallest
+# first, are two runs already in order, the lower half of the values read down
+# from the median and the upper half read up, so each middle deviation is found
+# by a binary search on how many of it and the smaller ones come from the lower
+# run, run for every segment at once ( about log2 of the longest segment steps )
+# instead of sorting the deviations
+def segmentRobust( values, offsets ):
+    values = np.asarray( values, dtype=np.float64 )
+    numSeg = len( offsets ) - 1
+    medians = np.full( numSeg, np.nan )
+    mads = np.full( numSeg, np.nan )
+    if len( values ) == 0:
+        return medians, mads
+    order, counts = segmentSort( values, offsets )
+    ordered = values[ order ]
+    starts = offsets[ :-1 ]
+    last = len( values ) - 1
+    found = counts > 0
+    middle = values[ rankRows( order, offsets, np.column_stack( [ ( counts - 1 ) // 2, counts // 2 ] ) ) ]
+    medians[ found ] = ( middle[ found, 0 ] + middle[ found, 1 ] ) / 2
+
+    # the lower run is ranks 0 .. ( counts - 1 ) // 2, all at or below the median,
+    # the upper run the rest, all at or above it
+    below = ( counts + 1 ) // 2
+    above = counts - below
+
+    def lowDev( ranks ): # ranks-th smallest deviation of the lower run
+        return medians - ordered[ np.clip( starts + below - 1 - ranks, 0, last ) ]
+
+    def highDev( ranks ): # and of the upper run
+        return ordered[ np.clip( starts + below + ranks, 0, last ) ] - medians
+
+    middleDevs = [ ]
+    for rank in [ ( counts - 1 ) // 2, counts // 2 ]:
+        # fewest and most of the rank + 1 smallest deviations the lower run can hold
+        lo = np.maximum( 0, rank + 1 - above )
+        hi = np.minimum( rank + 1, below )
+        while ( lo < hi ).any( ):
+            mid = ( lo + hi ) // 2
+            active = lo < hi
+            # the lower run's next deviation is still smaller: it holds more of them
+            more = active & ( lowDev( mid ) < highDev( rank - mid ) )
+            lo = np.where( more, mid + 1, lo )
+            hi = np.where( active & ~more, mid, hi )
+        middleDevs.append( np.fmax( np.where( lo > 0, lowDev( lo - 1 ), -np.inf ),
+                                    np.where( rank - lo >= 0, highDev( rank - lo ), -np.inf ) ) )
+    mads[ found ] = ( middleDevs[ 0 ][ found ] + middleDevs[ 1 ][ found ] ) / 2 * madScale
+    return medians, mads
+
+# featureRobust: takes an asteroid ( DataFrame or dict of arrays ) and the
+# features wanted, returns per-feature median and scaled MAD ( indexed like features )
+def featureRobust( asteroid, features ):
+    medians = np.zeros( len( features ) )
+    mads = np.zeros( len( features ) )
+    for featNum, feature in enumerate( features ):
+        values = np.asarray( asteroid[ feature ], dtype=np.float64 )
+        center, scale = segmentRobust( values, np.array( [ 0, len( values ) ] ) )
+        medians[ featNum ], mads[ featNum ] = center[ 0 ], scale[ 0 ]
+    return medians, mads
+
+# segmentTopK: takes flat values for every feature ( observations x features ),
+# the block offsets, k and skip. For every segment and feature returns the average
+# of the k lowest and k highest values after skipping the skip most extreme ones
+# ( damps single-point glitches ), and the global rows of the first value in each
+# average, as ( lowAvg, lowRows, highAvg, highRows ). NaNs are skipped; a segment
+# with too few values averages the k values closest to its extreme instead, and
+# one with none gets nan and a row of -1. Like segmentRobust the ranks are read
+# off one sorted pass per feature ( see segmentSort )
+def segmentTopK( values, offsets, k, skip ):
+    values = np.asarray( values, dtype=np.float64 )
+    if values.ndim == 1:
+        values = values[ :, None ]
+    numSeg = len( offsets ) - 1
+    numFeatures = values.shape[ 1 ]
+    lowAvg = np.full( ( numSeg, numFeatures ), np.nan )
+    highAvg = np.full( ( numSeg, numFeatures ), np.nan )
+    lowRows = np.full( ( numSeg, numFeatures ), -1 )
+    highRows = np.full( ( numSeg, numFeatures ), -1 )
+    if len( values ) == 0:
+        return lowAvg, lowRows, highAvg, highRows
+
+    for featNum in range( numFeatures ):
+        order, counts = segmentSort( values[ :, featNum ], offsets )
+        effective = np.minimum( skip + k, counts )
+        first = np.maximum( 0, effective - k )
+        ranks = first[ :, None ] + np.arange( k ) # from each end, first averaged rank on
+        used = ranks < effective[ :, None ]
+        found = effective > 0
+        # the high end is ranked down from each segment's last non-NaN value
+        for ends, avgs, rows in [ ( ranks, lowAvg, lowRows ),
+                                  ( counts[ :, None ] - 1 - ranks, highAvg, highRows ) ]:
+            picked = rankRows( order, offsets, ends )
+            with np.errstate( divide='ignore', invalid='ignore' ):
+                average = np.where( used, values[ picked, featNum ], 0 ).sum( axis=1 ) / used.sum( axis=1 )
+            avgs[ :, featNum ] = np.where( found, average, np.nan )
+            rows[ :, featNum ] = np.where( found, picked[ :, 0 ], -1 )
+    return lowAvg, lowRows, highAvg, highRows
+
+
+# blockRatings: takes a block, the rating attributes and their directions and
+# weights, returns each asteroid's anomaly rating ( 0-100 ): the same rating
+# rateAsteroid gives, normalized per asteroid with segmented min / max. NaNs are
+# skipped like rateObservations' nanmin / nanmax: a NaN value gives its
+# observation a nan rating, which the max passes over
+def blockRatings( block, ratingAttrs, directions, weights ):
+    offsets = block[ "offsets" ]
+    counts = np.diff( offsets )
+    obsRatings = np.zeros( offsets[ -1 ] )
+    with np.errstate( divide='ignore', invalid='ignore' ):
+        for attr, direction, weight in zip( ratingAttrs, directions, weights ):
+            values = np.asarray( block[ "cols" ][ attr ], dtype=np.float64 )
+            lows = np.repeat( np.fmin.reduceat( values, offsets[ :-1 ] ), counts )
+            highs = np.repeat( np.fmax.reduceat( values, offsets[ :-1 ] ), counts )
+            normed = ( values - lows ) / ( highs - lows )
+            if direction < 0:
+                normed = 1 - normed
+            obsRatings += normed * weight
+    return np.fmax.reduceat( obsRatings / np.sum( weights ), offsets[ :-1 ] ) * 100
+
+# weightedScores: takes the sigma matrix ( asteroids x features ) and a weight
+# per feature, returns each asteroid's weighted mean absolute sigma. Features
+# with no sigma ( nan ) add nothing to the score
+def weightedScores( sigmas, weights ):
+    weights = np.asarray( weights, dtype=np.float64 )
+    absSigmas = np.nan_to_num( np.abs( sigmas ) )
+    return absSigmas @ weights / weights.sum( )
+
+# coincidenceKeys: takes the outlier jds and nights ( asteroids x features ) and
+# the coincidence mode, returns ( keys, tolerance ): outliers coincide when their
+# keys are within the tolerance of each other. Modes:
+#     "night"   same night ( the night column )
+#     "obs"     same observation ( identical jd )
+#     a number  jds within that many days of each other, e.g. "0.5"
+def coincidenceKeys( obsJds, obsNights, mode ):
+    if mode == "night":
+        return obsNights, 0.0
+    if mode == "obs":
+        return obsJds, 0.0
+    return obsJds, float( mode )
+
+# coincidenceGroups: takes the coincidence keys and tolerance ( asteroids x
+# features ) and the filter level. Compares every pair of a row's outliers at once
+# and returns ( keep, numZeros, coincidences, coincidenceAt ): which outliers
+# coincide with at least fltrLevel outliers ( counting themselves ), how many per
+# asteroid don't, the size of each asteroid's biggest group of coinciding
+# outliers and the key ( night or jd ) of every group of two or more, earliest
+# first and nan padded ( asteroids x features ). A group is named by its
+# earliest key, so outliers within a jd window give one key, not one each. A
+# missing key ( nan ) coincides only with itself
+def coincidenceGroups( keys, tolerance, fltrLevel ):
+    keys = np.asarray( keys, dtype=np.float64 )
+    with np.errstate( invalid='ignore' ):
+        same = np.abs( keys[ :, :, None ] - keys[ :, None, : ] ) <= tolerance
+    same |= np.eye( keys.shape[ 1 ], dtype=bool )
+    sameCount = same.sum( axis=2 )
+    keep = sameCount >= fltrLevel
+
+    # every coinciding outlier's group key, sorted along the row, repeats dropped
+    groupKeys = np.where( same, keys[ :, None, : ], np.inf ).min( axis=2 )
+    groupKeys = np.sort( np.where( sameCount >= 2, groupKeys, np.inf ), axis=1 )
+    repeated = np.zeros( groupKeys.shape, dtype=bool )
+    repeated[ :, 1: ] = groupKeys[ :, 1: ] == groupKeys[ :, :-1 ]
+    groupKeys[ repeated ] = np.inf
+    coincidenceAt = np.sort( groupKeys, axis=1 )
+    coincidenceAt[ np.isinf( coincidenceAt ) ] = np.nan
+    return keep, ( ~keep ).sum( axis=1 ), sameCount.max( axis=1 ), coincidenceAt
+
+# blockSigmas: takes a block ( no empty segments ), the features, their weights
+# and the sigma mode and topK / topSkip ( see sigmaBlock ). Returns the weighted
+# sigma, absolute sigma, global row and value of every segment's outlier in each
+# feature as ( sigmas, absSigmas, outRows, outliers ), each segments x features.
+# NaNs are skipped like fillSigmaMatrix skips them; a segment with no values of
+# a feature gets a nan sigma and an outlier row of -1
+def blockSigmas( block, features, weights, mode="mean", topK=1, topSkip=0 ):
+    offsets = block[ "offsets" ]
+    shape = ( len( offsets ) - 1, len( features ) )
+    sigmas = np.zeros( shape )
+    absSigmas = np.zeros( shape )
+    outRows = np.zeros( shape, dtype=np.int64 )
+    outliers = np.zeros( shape )
+
+    if topK != 1 or topSkip != 0:
+        # every feature's averaged extremes in one batched selection
+        lowAvg, lowRows, highAvg, highRows = segmentTopK(
+            np.column_stack( [ np.asarray( block[ "cols" ][ feature ], dtype=np.float64 )
+                               for feature in features ] ), offsets, topK, topSkip )
+
+    for featNum, feature in enumerate( features ):
+        stats = segmentMoments( block[ "cols" ][ feature ], offsets )
+        center = stats[ "mean" ]
+        with np.errstate( divide='ignore', invalid='ignore' ):
+            scale = np.sqrt( stats[ "m2" ] / ( stats[ "count" ] - 1 ) )
+        if mode == "robust":
+            center, scale = segmentRobust( block[ "cols" ][ feature ], offsets )
+        minVal, minRows = stats[ "min" ], stats[ "argmin" ]
+        maxVal, maxRows = stats[ "max" ], stats[ "argmax" ]
+        if topK != 1 or topSkip != 0:
+            minVal, minRows = lowAvg[ :, featNum ], lowRows[ :, featNum ]
+            maxVal, maxRows = highAvg[ :, featNum ], highRows[ :, featNum ]
+        useHigh, sigmas[ :, featNum ], absSigmas[ :, featNum ] = pickSigmas(
+            center, scale, minVal, maxVal, weights[ feature ] )
+        outRows[ :, featNum ] = np.where( useHigh, maxRows, minRows )
+        outliers[ :, featNum ] = np.where( useHigh, maxVal, minVal )
+    return sigmas, absSigmas, outRows, outliers
+
+# bandBlock: takes a block, the bands ( fid values ) to score separately and the
+# columns wanted. Returns ( bandBlock, segAst, segBand ): a block whose segments
+# are the non-empty ( asteroid, band ) groups in asteroid then band order, each
+# keeping its rows' original order, plus every segment's asteroid and band
+# position. bandBlock[ "rows" ] maps its rows back to the block's. Observations
+# in no listed band are left out
+def bandBlock( block, bands, columns ):
+    counts = np.diff( block[ "offsets" ] )
+    numAst = len( counts )
+    # position of every observation's band in bands ( -1 if not listed ), one lookup
+    lookup = np.full( max( bands ) + 2, -1 )
+    lookup[ list( bands ) ] = np.arange( len( bands ) )
+    fid = np.asarray( block[ "cols" ][ "fid" ], dtype=np.int64 )
+    bandPos = lookup[ np.clip( fid, 0, len( lookup ) - 1 ) ]
+    groupIds = np.repeat( np.arange( numAst ), counts ) * len( bands ) + bandPos
+
+    rows = np.flatnonzero( bandPos >= 0 )
+    rows = rows[ np.argsort( groupIds[ rows ], kind="stable" ) ]
+    groupCounts = np.bincount( groupIds[ rows ], minlength=numAst * len( bands ) )
+    present = np.flatnonzero( groupCounts )
+    offsets = np.zeros( len( present ) + 1, dtype=np.int64 )
+    offsets[ 1: ] = np.cumsum( groupCounts[ present ] )
+    return ( { "names": np.asarray( block[ "names" ] )[ present // len( bands ) ],
+               "offsets": offsets,
+               "cols": { col: np.asarray( block[ "cols" ][ col ] )[ rows ] for col in columns },
+               "rows": rows },
+             present // len( bands ), present % len( bands ) )
+
+# bandSigmas: same as blockSigmas, but every feature's statistics are computed
+# separately for each band ( fid ) in one set of segmented reductions over the
+# ( asteroid, band ) groups, so colour differences between the ZTF bands don't
+# read as outliers. Returns ( sigmas, absSigmas, outRows, outliers ), each
+# asteroids x features x bands, with nan sigmas and rows of -1 for a band an
+# asteroid has no observations in
+def bandSigmas( block, features, weights, bands, mode="mean", topK=1, topSkip=0 ):
+    groups, segAst, segBand = bandBlock( block, bands, features )
+    shape = ( len( block[ "offsets" ] ) - 1, len( features ), len( bands ) )
+    sigmas = np.full( shape, np.nan )
+    absSigmas = np.full( shape, np.nan )
+    outRows = np.full( shape, -1 )
+    outliers = np.full( shape, np.nan )
+    if len( segAst ) == 0:
+        return sigmas, absSigmas, outRows, outliers
+
+    groupSigmas, groupAbs, groupRows, groupOutliers = blockSigmas( groups, features, weights, mode, topK, topSkip )
+    sigmas[ segAst, :, segBand ] = groupSigmas
+    absSigmas[ segAst, :, segBand ] = groupAbs
+    # back to the block's rows, keeping -1 for a group with no values of a feature
+    outRows[ segAst, :, segBand ] = np.where( groupRows >= 0, groups[ "rows" ][ np.maximum( groupRows, 0 ) ], -1 )
+    outliers[ segAst, :, segBand ] = groupOutliers
+    return sigmas, absSigmas, outRows, outliers
+
+# sigmaBlock: takes a block, the wanted attributes, their weights, the filter
+# [ type, level ], the rating attributes and their directions, the sigma mode
+# ( "mean": distance from the mean in stdevs, "robust": distance from the median
+# in scaled MADs ), topK / topSkip ( measure the average of the topK most
+# extreme values after skipping topSkip, instead of the single extreme; 1 / 0 is
+# the plain min and max ) and the coincidence mode for filter 1 ( see
+# coincidenceKeys ). Returns a dict of
+# per-asteroid result fields ( the same names as the result records in
+# 2astOutlierMatNew.py ): "sigma", "id", "jd" and "outlier" ( asteroids x
+# features, "night" only if the block has a night column ), "rowSum",
+# "absRowSum", "rating", "coincidences" and "coincidenceAt" ( filter 1 only ) and
+# whether the filter "kept" it. With bands ( fid values, e.g. [ 1, 2 ] ) every
+# feature's statistics are computed separately per band ( see bandSigmas ), each
+# feature is scored in its most anomalous band and the sigmas of every band are
+# returned as "bandSigma" ( asteroids x features x bands )
+def sigmaBlock( block, wantedAttrs, weights, fltr, ratingAttrs, ratingDirs, mode="mean", topK=1, topSkip=0,
+                coincidence="night", bands=( ) ):
+    fltrType, fltrLevel = fltr
+    numAst = len( block[ "names" ] )
+    hasNight = "night" in block[ "cols" ]
+
+    if len( bands ) != 0:
+        # each feature is scored in the band where it is most anomalous
+        bandSigma, bandAbs, bandRows, bandOutliers = bandSigmas( block, wantedAttrs, weights, bands,
+                                                                 mode, topK, topSkip )
+        pick = np.where( np.isnan( bandAbs ), -np.inf, bandAbs ).argmax( axis=2 )[ :, :, None ]
+        sigmas = np.take_along_axis( bandSigma, pick, axis=2 )[ :, :, 0 ]
+        absSigmas = np.take_along_axis( bandAbs, pick, axis=2 )[ :, :, 0 ]
+        outRows = np.take_along_axis( bandRows, pick, axis=2 )[ :, :, 0 ]
+        outliers = np.take_along_axis( bandOutliers, pick, axis=2 )[ :, :, 0 ]
+    else:
+        sigmas, absSigmas, outRows, outliers = blockSigmas( block, wantedAttrs, weights, mode, topK, topSkip )
+
+    # id, jd and night of every outlier ( none for a feature with no observations
+    # in any scored band )
+    found = outRows >= 0
+    safeRows = np.maximum( outRows, 0 )
+    ids = np.where( found, np.asarray( block[ "cols" ][ "id" ] )[ safeRows ], "" ).astype( object )
+    obsJds = np.where( found, np.asarray( block[ "cols" ][ "jd" ] )[ safeRows ], np.nan )
+    obsNights = np.full( ( numAst, len( wantedAttrs ) ), np.nan )
+    if hasNight:
+        obsNights = np.where( found, np.asarray( block[ "cols" ][ "night" ] )[ safeRows ], np.nan )
+
+    rowSum = sigmas.sum( axis=1 )
+    absRowSum = absSigmas.sum( axis=1 )
+    ratings = np.full( numAst, np.nan )
+    strip = np.zeros( numAst, dtype=bool )
+    features = sigmas.copy( )
+    coincidences = np.zeros( numAst, dtype=np.int64 )
+    coincidenceAt = np.full( ( numAst, len( wantedAttrs ) ), np.nan )
+
+    if fltrType == 1:
+        # keep only outliers that coincide with other features' outliers
+        keys, tolerance = coincidenceKeys( obsJds, obsNights, coincidence )
+        keep, numZeros, coincidences, coincidenceAt = coincidenceGroups( keys, tolerance, fltrLevel )
+        features[ ~keep ] = 0
+        strip = numZeros > fltrLevel
+    elif fltrType == 2:
+        ratings = blockRatings( block, ratingAttrs, [ ratingDirs[ attr ] for attr in ratingAttrs ],
+                                [ weights[ attr ] for attr in ratingAttrs ] )
+        strip = ratings < fltrLevel
+
+    scored = { "sigma": features,
+               "id": ids,
+               "jd": obsJds,
+               "outlier": outliers,
+               "rowSum": rowSum,
+               "absRowSum": absRowSum,
+               "rating": ratings,
+               "coincidences": coincidences,
+               "coincidenceAt": coincidenceAt,
+               "kept": ~strip }
+    if hasNight:
+        scored[ "night" ] = obsNights
+    if len( bands ) != 0:
+        scored[ "bandSigma" ] = bandSigma
+    return scored
@@ -0,0 +1,294 @@
+#########################################################################################
+### Program: SNAPS Incremental Sigma State
+### Last Update: 10.18.2026
+#########################################################################################
+# Keeps the sigma matrix up to date as ZTF adds observations instead of rerunning
+# runProgram over the whole archive. For every asteroid and wanted feature the
+# state stores the running count, mean and M2 ( sum of squared differences from
+# the mean ) plus the min and max with the ZTF id and jd they came from, and the
+# sigma row computed from them. An update only pulls observations with a jd newer
+# than the last one processed, merges their moments into the stored ones and
+# recomputes the sigmas of the asteroids they touched, so a nightly refresh costs
+# time in proportion to the new data, not the archive.
+#
+# The anomaly rating needs every observation normalized against the asteroid's
+# current range, so it can't be kept this way: exports from the state support
+# no filter ( 4 ), the coincidence filter ( 1 ) and the weighted filter ( 3 ), not
+# the rating filter ( 2 ). The weighted filter only reads the stored sigmas, so an
+# export can be re-filtered with new --weights as often as wanted.
+# The state keeps the jd of each outlier but not its night, so the coincidence
+# filter matches outliers by observation or a jd window ( --coincidence obs or a
+# number of days; night falls back to obs ).
+# Medians can't be merged either, so the state always uses mean / stdev sigmas
+# ( --sigmaMode mean ), with the ZTF bands mixed ( no --bands ).
+#
+# State directory layout:
+#     meta.json        features, weights, number of asteroids, the last jd processed
+#                      and the generation holding the records folded up to it
+#     gen-N/state.npy  one record per asteroid ( stateDtype ), sorted by ssnamenr
+#
+# Usage:
+#     python sigmaState.py update stateDir [flags]
+#         fold in observations newer than the last update ( the first update builds
+#         the state from every observation )
+#     python sigmaState.py export stateDir fileType fileName [fltrType fltrLvl] [flags]
+#         write the sigma matrix the same way runProgram exports it
+#
+#     flags: --cache DIR reads new observations from the local observation cache
+#            ( synced first unless --cacheSync False ) instead of MongoDB
+#            --coincidence obs|DAYS how the export's filter 1 matches outliers
+#            --weights PAIRS|FILE.json feature weights for the export's filter 3
+#            --features LIST|FILE.json|all features the first update builds the
+#            state for ( later updates must use the same ones )
+
+## IMPORTS ##############################################################################
+import os
+import sys
+import importlib
+import numpy as np
+import snapsDB
+import obsCache
+import sigmaEngine
+
+## GLOBAL VARS ##########################################################################
+stateFile = "state"
+fetchSize = 100000 # new observations folded in at a time
+idWidth = "U32" # ZTF ids are stored fixed width so the state loads without pickle
+
+## FUNCTION DEFINITIONS #################################################################
+
+# stateDtype: takes the number of features, returns the dtype of one asteroid's
+# state record
+def stateDtype( numFeatures ):
+    perFeature = ( numFeatures, )
+    return np.dtype( [
+        ( "name", np.int64 ),
+        ( "count", np.int64, perFeature ),
+        ( "mean", np.float64, perFeature ),
+        ( "m2", np.float64, perFeature ),
+        ( "min", np.float64, perFeature ),
+        ( "minId", idWidth, perFeature ),
+        ( "minJd", np.float64, perFeature ),
+        ( "max", np.float64, perFeature ),
+        ( "maxId", idWidth, perFeature ),
+        ( "maxJd", np.float64, perFeature ),
+        # sigma row, recomputed for every asteroid an update touches
+        ( "sigma", np.float64, perFeature ),
+        ( "outId", idWidth, perFeature ),
+        ( "outJd", np.float64, perFeature ),
+        ( "outlier", np.float64, perFeature ),
+        ( "rowSum", np.float64 ),
+        ( "absRowSum", np.float64 )
+    ] )
+
+# emptyState: takes asteroid names and the number of features, returns state
+# records that have seen no observations yet
+def emptyState( names, numFeatures ):
+    state = np.zeros( len( names ), dtype=stateDtype( numFeatures ) )
+    state[ "name" ] = names
+    for field in [ "mean", "m2", "min", "max", "sigma", "outlier" ]:
+        state[ field ] = np.nan
+    state[ "min" ] = np.inf
+    state[ "max" ] = -np.inf
+    return state
+
+# loadState: takes the state directory, returns ( meta, state ), or ( None, None )
+# if nothing has been built there yet
+def loadState( stateDir ):
+    meta = obsCache.readMeta( stateDir )
+    if meta is None:
+        return None, None
+    return meta, np.load( os.path.join( obsCache.generationDir( stateDir, meta ), stateFile + ".npy" ) )
+
+# saveState: takes the state directory, the metadata and the state records and
+# writes them as the state's next generation ( see obsCache.saveGeneration ).
+# The records and the last jd they include switch over together, so an
+# interrupted update leaves the previous state usable and the next update
+# folds in exactly the observations it hadn't
+def saveState( stateDir, meta, state ):
+    obsCache.saveGeneration( stateDir, { stateFile: state }, meta )
+
+# addNames: takes the state and a sorted array of asteroid names, returns the
+# state with a fresh record for every name it didn't have ( still sorted ) and
+# the position of each given name in it
+def addNames( state, names ):
+    newNames = np.setdiff1d( names, state[ "name" ] )
+    if len( newNames ) != 0:
+        state = np.concatenate( [ state, emptyState( newNames, state[ "count" ].shape[ 1 ] ) ] )
+        state = state[ np.argsort( state[ "name" ], kind="stable" ) ]
+    return state, np.searchsorted( state[ "name" ], names )
+
+# foldChunk: takes the state, a dict of new observation columns, the features and
+# their weights. Merges the observations' moments and extremes into the state and
+# recomputes the sigma rows of the asteroids they belong to. Returns the new state
+def foldChunk( state, cols, features, weights ):
+    order = np.lexsort( ( cols[ "jd" ], cols[ "ssnamenr" ] ) )
+    cols = { col: np.asarray( values )[ order ] for col, values in cols.items( ) }
+    names, offsets = obsCache.buildIndex( cols[ "ssnamenr" ] )
+    state, rows = addNames( state, names )
+    touched = state[ rows ]
+
+    for featNum, feature in enumerate( features ):
+        new = sigmaEngine.segmentMoments( cols[ feature ], offsets )
+        count, mean, m2 = mergeFeature( touched, featNum, new )
+        touched[ "count" ][ :, featNum ] = count
+        touched[ "mean" ][ :, featNum ] = mean
+        touched[ "m2" ][ :, featNum ] = m2
+
+        # strictly smaller / larger, so on ties the earlier observation stays
+        newMin = new[ "min" ] < touched[ "min" ][ :, featNum ]
+        minRows = new[ "argmin" ][ newMin ]
+        touched[ "min" ][ newMin, featNum ] = new[ "min" ][ newMin ]
+        touched[ "minId" ][ newMin, featNum ] = cols[ "id" ][ minRows ]
+        touched[ "minJd" ][ newMin, featNum ] = cols[ "jd" ][ minRows ]
+
+        newMax = new[ "max" ] > touched[ "max" ][ :, featNum ]
+        maxRows = new[ "argmax" ][ newMax ]
+        touched[ "max" ][ newMax, featNum ] = new[ "max" ][ newMax ]
+        touched[ "maxId" ][ newMax, featNum ] = cols[ "id" ][ maxRows ]
+        touched[ "maxJd" ][ newMax, featNum ] = cols[ "jd" ][ maxRows ]
+
+    updateSigmas( touched, features, weights )
+    state[ rows ] = touched
+    return state
+
+# mergeFeature: takes the touched state records, a feature number and that
+# feature's moments over the new observations, returns the merged count, mean and M2
+def mergeFeature( touched, featNum, new ):
+    return sigmaEngine.mergeMoments( touched[ "count" ][ :, featNum ], touched[ "mean" ][ :, featNum ],
+                                     touched[ "m2" ][ :, featNum ],
+                                     new[ "count" ], new[ "mean" ], new[ "m2" ] )
+
+# updateSigmas: takes state records, the features and their weights, and
+# recomputes each record's sigma row from its stored moments, the same way
+# fillSigmaMatrix does from the raw observations
+def updateSigmas( records, features, weights ):
+    absSigmas = np.zeros( records[ "sigma" ].shape )
+    with np.errstate( divide='ignore', invalid='ignore' ):
+        stdevs = np.sqrt( records[ "m2" ] / ( records[ "count" ] - 1 ) )
+    for featNum, feature in enumerate( features ):
+        useHigh, records[ "sigma" ][ :, featNum ], absSigmas[ :, featNum ] = sigmaEngine.pickSigmas(
+            records[ "mean" ][ :, featNum ], stdevs[ :, featNum ],
+            records[ "min" ][ :, featNum ], records[ "max" ][ :, featNum ], weights[ feature ] )
+        records[ "outId" ][ :, featNum ] = np.where( useHigh, records[ "maxId" ][ :, featNum ],
+                                                     records[ "minId" ][ :, featNum ] )
+        records[ "outJd" ][ :, featNum ] = np.where( useHigh, records[ "maxJd" ][ :, featNum ],
+                                                     records[ "minJd" ][ :, featNum ] )
+        records[ "outlier" ][ :, featNum ] = np.where( useHigh, records[ "max" ][ :, featNum ],
+                                                       records[ "min" ][ :, featNum ] )
+    records[ "rowSum" ] = records[ "sigma" ].sum( axis=1 )
+    records[ "absRowSum" ] = absSigmas.sum( axis=1 )
+
+# newChunks: takes the last jd processed, the columns needed and the run options.
+# Yields dicts of column arrays holding every observation newer than that jd,
+# fetchSize observations at a time, from the cache or MongoDB
+def newChunks( lastJd, columns, opts ):
+    if opts[ "cache" ]:
+        jds = obsCache.loadColumn( opts[ "cache" ], "jd" )
+        newRows = np.flatnonzero( jds > lastJd )
+        for start in range( 0, len( newRows ), fetchSize ):
+            rows = newRows[ start:start + fetchSize ]
+            yield { col: obsCache.loadColumn( opts[ "cache" ], col )[ rows ] for col in columns }
+        return
+
+    # served by the jd index ( see indexAdvisor.py )
+    yield from obsCache.findColumns( snapsDB.getCollection( "mag18o8" ), { "jd": { "$gt": lastJd } }, columns )
+
+# update: takes the state directory, the features, their weights and the run
+# options. Folds every observation newer than the last update into the state and
+# saves it. Returns the number of new observations
+def update( stateDir, features, weights, opts ):
+    meta, state = loadState( stateDir )
+    if meta is None:
+        meta = { "features": features, "weights": weights, "lastJd": -np.inf }
+        state = emptyState( np.array( [ ], dtype=np.int64 ), len( features ) )
+    elif meta[ "features" ] != features or meta[ "weights" ] != weights:
+        raise ValueError( "state at " + stateDir + " was built for features " +
+                          str( meta[ "features" ] ) + " with weights " + str( meta[ "weights" ] ) +
+                          ", rebuild it in a new directory" )
+
+    columns = [ "ssnamenr", "jd", "id" ] + features
+    newRows = 0
+    lastJd = meta[ "lastJd" ]
+    for cols in newChunks( meta[ "lastJd" ], columns, opts ):
+        state = foldChunk( state, cols, features, weights )
+        newRows += len( cols[ "jd" ] )
+        lastJd = max( lastJd, float( np.nanmax( cols[ "jd" ] ) ) )
+
+    if newRows == 0:
+        print( "Sigma state at " + stateDir + " is up to date" )
+        return 0
+    meta[ "lastJd" ] = lastJd
+    meta[ "count" ] = int( len( state ) )
+    saveState( stateDir, meta, state )
+    print( "Sigma state at " + stateDir + ": folded in " + str( newRows ) + " observations" )
+    return newRows
+
+# toResults: takes the SNAPS module, the state records, the filter, the
+# coincidence mode, the filter 3 weights and the weights the state's sigmas were
+# scaled by, returns result records ( resultDtype ) with the filter applied,
+# ready for formatDataTable
+def toResults( snaps, state, fltr, coincidence="obs", weights=None, sigmaWeights=None ):
+    results = snaps.newResults( state[ "name" ] )
+    results[ "found" ] = state[ "count" ].sum( axis=1 ) > 0
+    results[ "kept" ] = results[ "found" ]
+    results[ "sigma" ] = state[ "sigma" ]
+    results[ "id" ] = state[ "outId" ]
+    results[ "jd" ] = state[ "outJd" ]
+    results[ "outlier" ] = state[ "outlier" ]
+    results[ "rowSum" ] = state[ "rowSum" ]
+    results[ "absRowSum" ] = state[ "absRowSum" ]
+
+    fltrType, fltrLevel = fltr
+    if fltrType == 1:
+        if coincidence == "night":
+            print( "WARNING: the sigma state has no outlier nights, matching outliers by observation" )
+            coincidence = "obs"
+        keys, tolerance = sigmaEngine.coincidenceKeys( results[ "jd" ], results[ "night" ], coincidence )
+        keep, numZeros, counts, coincidenceAt = sigmaEngine.coincidenceGroups( keys, tolerance, fltrLevel )
+        results[ "sigma" ][ ~keep ] = 0
+        results[ "kept" ] &= numZeros <= fltrLevel
+        results[ "coincidences" ] = counts
+        results[ "coincidenceAt" ] = coincidenceAt
+    elif fltrType == 2:
+        print( "WARNING: the rating filter needs every observation, use runProgram for it" )
+    elif fltrType == 3:
+        snaps.filterByWeight( results, fltrLevel, weights, sigmaWeights )
+    return results
+
+def main( ):
+    snaps = importlib.import_module( "2astOutlierMatNew" )
+    argv, opts = snaps.getOptions( sys.argv )
+    if len( argv ) < 3 or argv[ 1 ] not in [ "update", "export" ]:
+        print( "Usage: python sigmaState.py update stateDir [flags]\n"
+               "       python sigmaState.py export stateDir fileType fileName [fltrType fltrLvl] [flags]" )
+        return
+    stateDir = argv[ 2 ]
+
+    if opts[ "bands" ]:
+        print( "WARNING: the sigma state mixes the ZTF bands, --bands is ignored" )
+    if argv[ 1 ] == "update":
+        if opts[ "features" ]:
+            snaps.setFeatures( snaps.parseFeatures( opts[ "features" ] ) )
+        if opts[ "cache" ] and opts[ "cacheSync" ]:
+            obsCache.syncCache( snapsDB.getCollection( snaps.mag18Name ), opts[ "cache" ] )
+        weights = { feature: snaps.weightDict[ feature ] for feature in snaps.wantedAttrs }
+        update( stateDir, snaps.wantedAttrs, weights, opts )
+        return
+
+    meta, state = loadState( stateDir )
+    if meta is None:
+        print( "ERROR: no sigma state at " + stateDir + ", run an update first" )
+        return
+    # export in the layout of the features the state was built for
+    snaps.setFeatures( meta[ "features" ] )
+    fileType, fileName = int( argv[ 3 ] ), argv[ 4 ]
+    fltr = [ int( argv[ 5 ] ), float( argv[ 6 ] ) ] if len( argv ) > 6 else [ 4, 0 ]
+    results = toResults( snaps, state, fltr, opts[ "coincidence" ], snaps.filterWeights( opts ),
+                         [ meta[ "weights" ][ feature ] for feature in meta[ "features" ] ] )
+    dataset = snaps.formatDataTable( results, coincidence=( fltr[ 0 ] == 1 ), weighted=( fltr[ 0 ] == 3 ) )
+    newData = snaps.stripZeroRows( dataset )
+    snaps.exportFile( fileType, fileName, newData )
+
+if __name__ == "__main__":
+    main( )
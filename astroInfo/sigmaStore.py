@@ -0,0 +1,118 @@
+#########################################################################################
+### Program: SNAPS Sigma Matrix Store
+### Last Update: 10.18.2026
+#########################################################################################
+# Builds the sigma matrix once and searches it many times, like the old buildCSV.py /
+# totalSearch.py split did. A run given --store DIR saves its result records ( the
+# typed resultDtype array, no pickle ) and the query command loads them and filters
+# the whole catalog with one expression, evaluated vectorized over the table columns:
+#
+#     elong > 3 and abs(rb) < 2
+#     `Row Sum` > 10 or H < -4          ( backticks around names with spaces )
+#     Rating >= 90 and Name > 500000
+#
+# so trying new thresholds takes seconds instead of rerunning runProgram. Build the
+# store with no filter ( fltrType 4 ) to keep every asteroid's sigmas; asteroids a
+# run's filter stripped are left out of queries.
+#
+# Given --weights ( and / or --level ), a query first re-scores the stored sigmas
+# with the weighted filter ( 3, see filterByWeight ): every found asteroid scoring
+# at least the level ( default 0, or the store's own filter 3 level ) is kept, and
+# the table gets its Weighted Score column, so new weights need no rerun either.
+#
+# Store directory layout:
+#     meta.json        features, bands, filter and options of the run that built it
+#     gen-N/matrix.npy one result record per asteroid ( resultDtype in 2astOutlierMatNew.py )
+#
+# Usage:
+#     python 2astOutlierMatNew.py maxIn offset 4 0 False False --store DIR
+#         build ( or rebuild ) the store
+#     python sigmaStore.py query DIR "expression" [fileType fileName] [--weights W] [--level L]
+#         print the matching asteroids, or export them ( 1: .html, 2: .csv )
+
+## IMPORTS ##############################################################################
+import os
+import sys
+import importlib
+import numpy as np
+import obsCache
+
+## GLOBAL VARS ##########################################################################
+matrixFile = "matrix"
+storeVersion = 1 # bump if the store layout changes
+
+## FUNCTION DEFINITIONS #################################################################
+
+# saveMatrix: takes the store directory, the result records and the metadata of
+# the run ( features, filter, options ) and writes them as the store's next
+# generation ( see obsCache.saveGeneration ), so a crashed build leaves the old
+# store usable
+def saveMatrix( storeDir, results, meta ):
+    meta = dict( meta, version=storeVersion, count=int( len( results ) ) )
+    obsCache.saveGeneration( storeDir, { matrixFile: results }, meta )
+    print( "Sigma matrix store at " + storeDir + ": " + str( len( results ) ) + " asteroids" )
+
+# loadMatrix: takes the store directory, returns its ( meta, results ), or
+# ( None, None ) if there is no store there ( or it has an older layout )
+def loadMatrix( storeDir ):
+    meta = obsCache.readMeta( storeDir )
+    if meta is None or meta.get( "version" ) != storeVersion:
+        return None, None
+    return meta, np.load( os.path.join( obsCache.generationDir( storeDir, meta ), matrixFile + ".npy" ) )
+
+# getLevel: takes the command line arguments and splits out --level, which only
+# queries take. Returns the remaining arguments and the level ( None if not given )
+def getLevel( argv ):
+    if "--level" not in argv[ :-1 ]:
+        return argv, None
+    flagAt = argv.index( "--level" )
+    return argv[ :flagAt ] + argv[ flagAt + 2: ], float( argv[ flagAt + 1 ] )
+
+# queryMatrix: takes a table from formatDataTable and an expression over its
+# columns, returns the rows the expression holds for. The expression is
+# evaluated on whole columns at once ( pandas query ), never row by row
+def queryMatrix( dataset, expression ):
+    return dataset.query( expression )
+
+def main( ):
+    snaps = importlib.import_module( "2astOutlierMatNew" )
+    argv, level = getLevel( sys.argv )
+    argv, opts = snaps.getOptions( argv )
+    if len( argv ) < 4 or argv[ 1 ] != "query":
+        print( "Usage: python sigmaStore.py query storeDir \"expression\" [fileType fileName]"
+               " [--weights W] [--level L]" )
+        return
+    storeDir, expression = argv[ 2 ], argv[ 3 ]
+
+    meta, results = loadMatrix( storeDir )
+    if meta is None:
+        print( "ERROR: no sigma matrix store at " + storeDir + ", run with --store first" )
+        return
+    # the table has the layout of the features and bands the store was built for
+    snaps.setFeatures( meta[ "features" ] )
+    snaps.setBands( meta.get( "bands", "" ) )
+
+    fltrType, fltrLevel = meta[ "filter" ]
+    if opts[ "weights" ] or level is not None:
+        if level is None:
+            level = fltrLevel if fltrType == 3 else 0
+        # stores from before sigmaWeights was kept were scaled by weightDict
+        snaps.filterByWeight( results, level, snaps.filterWeights( opts ), meta.get( "sigmaWeights" ) )
+        fltrType = 3
+    dataset = snaps.formatDataTable( results[ results[ "kept" ] ], coincidence=( fltrType == 1 ),
+                                     weighted=( fltrType == 3 ) )
+    try:
+        matches = queryMatrix( dataset, expression )
+    except Exception as err:
+        print( "ERROR: can't evaluate " + expression + ": " + str( err ) )
+        print( "Columns: " + ", ".join( dataset.columns ) )
+        return
+
+    print( str( len( matches ) ) + " of " + str( len( dataset ) ) + " asteroids match " + expression )
+    if len( argv ) > 5:
+        snaps.exportFile( int( argv[ 4 ] ), argv[ 5 ], matches )
+    else:
+        print( matches )
+
+if __name__ == "__main__":
+    main( )
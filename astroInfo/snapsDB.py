@@ -0,0 +1,97 @@
+#########################################################################################
+### Program: SNAPS Database Connection Manager
+### Last Update: 10.18.2026
+#########################################################################################
+# Nothing connects at import time. The first call to getCollection reads config.ini
+# and builds one pooled MongoClient for the process, and every later query reuses
+# it. Clients are keyed by process id, so a worker forked by a parallel run never
+# reuses the sockets it inherited from its parent and opens its own pool instead.
+#
+# config.ini [Database] section:
+#     dbUser, dbHost, dbPort, dbPass   required
+#     poolSize                         max connections per process (default 10)
+#     timeoutMS                        connect / server selection timeout (default 20000)
+#     socketTimeoutMS                  timeout on a single query, 0 = none (default 0)
+#
+# For benchmarking, useServer points every process at another server ( e.g. a local
+# mongod loaded with synthetic data ) and setClient hands this process, and any
+# worker forked from it, an in-process stand-in client instead.
+
+## IMPORTS ##############################################################################
+import os
+import configparser as cfp
+from pymongo import MongoClient
+
+## GLOBAL VARS ##########################################################################
+configFile = 'config.ini'
+dbName = 'ztf'
+clients = { } # process id -> MongoClient
+serverOverride = None # connection string used instead of config.ini when set
+standIn = None # client set by setClient, used instead of any server when set
+
+## FUNCTION DEFINITIONS #################################################################
+
+# getSecrets: takes the config file path and returns the connection details and
+# pool settings from its [Database] section
+def getSecrets( configPath=configFile ):
+    config = cfp.ConfigParser()
+    config.read( configPath )
+    user = config.get( 'Database', 'dbUser' )
+    host = config.get( 'Database', 'dbHost' )
+    port = config.get( 'Database', 'dbPort' )
+    pswd = config.get( 'Database', 'dbPass' )
+    poolSettings = {
+        "maxPoolSize": config.getint( 'Database', 'poolSize', fallback=10 ),
+        "connectTimeoutMS": config.getint( 'Database', 'timeoutMS', fallback=20000 ),
+        "serverSelectionTimeoutMS": config.getint( 'Database', 'timeoutMS', fallback=20000 ),
+        "socketTimeoutMS": config.getint( 'Database', 'socketTimeoutMS', fallback=0 ) or None
+    }
+
+    return [ user, host, port, pswd, poolSettings ]
+
+# getClient: takes no inputs, returns this process's MongoClient, creating it on
+# first use. A forked worker sees a different pid and gets a fresh client,
+# except for a stand-in from setClient, which holds no sockets and is kept
+def getClient( ):
+    if standIn is not None:
+        return standIn
+    pid = os.getpid( )
+    if pid not in clients:
+        # drop clients inherited from a parent process without closing them,
+        # their sockets still belong to the parent
+        clients.clear( )
+        if serverOverride is not None:
+            dest = serverOverride
+            poolSettings = { }
+        else:
+            user, host, port, pswd, poolSettings = getSecrets( )
+            dest = "mongodb://" + user + ":" + pswd + "@" + host + ":" + port
+        clients[ pid ] = MongoClient( dest, connect=False, **poolSettings )
+    return clients[ pid ]
+
+# useServer: takes a connection string and makes every later client ( in this
+# process and any forked from it ) connect there instead of the config.ini server
+def useServer( dest ):
+    global serverOverride, standIn
+    serverOverride = dest
+    standIn = None
+    clients.clear( )
+
+# setClient: takes an already built client ( e.g. an in-process stand-in, such
+# as mongomock's ) and makes this process and the workers it forks use it for
+# every query. Each forked worker queries its own copy of an in-process client
+def setClient( client ):
+    global standIn
+    standIn = client
+    clients.clear( )
+
+# getCollection: takes a collection name, returns that collection of the ztf
+# database on this process's pooled client
+def getCollection( name ):
+    return getClient( )[ dbName ][ name ]
+
+# closeClient: takes no inputs, closes this process's client if it has one
+def closeClient( ):
+    client = clients.pop( os.getpid( ), None )
+    if client is not None:
+        client.close( )
@@ -0,0 +1,243 @@
+#########################################################################################
+### Program: SNAPS Synthetic ZTF Data & Benchmark
+### Last Update: 10.18.2026
+#########################################################################################
+# Generates realistic mag18o8 / asteroids_all shaped data so SNAPS can be run and
+# timed without the university database. Each asteroid gets a log-normal number of
+# observations taken in pairs on the same night, a random ZTF band ( fid ) per
+# observation with a g-r colour offset in H, and a small fraction of asteroids get
+# one "outburst" night where elong, rb and mag18omag8 are pushed out together.
+#
+# Usage:
+#     python synthData.py numAst target [maxIn] [synth flags] [SNAPS flags]
+#
+#     target: mock         load into an in-process mongomock stand-in and benchmark
+#             mongodb://.. load into a ( local ) mongod and benchmark against it
+#             a directory  write the data straight into a local observation cache
+#     maxIn:  asteroids to run through runProgram in the benchmark (default all)
+#
+#     synth flags: --seed, --obsMedian, --obsSpread, --outlierFrac ( see synthDefaults )
+#     any other --flag value pairs are passed on to runProgram ( --engine, --cache ... )
+#
+# e.g. python synthData.py 1000 mock
+#      python synthData.py 100000 mongodb://localhost:27017 --prefetch 4
+
+## IMPORTS ##############################################################################
+import os
+import sys
+import time
+import tempfile
+import importlib
+import numpy as np
+import snapsDB
+import obsCache
+
+## GLOBAL VARS ##########################################################################
+synthDefaults = {
+    "seed": 0, # random seed, same seed gives the same catalog
+    "obsMedian": 60, # median number of observations per asteroid
+    "obsSpread": 0.8, # log-normal spread of the observation counts
+    "outlierFrac": 0.01 # fraction of asteroids with an injected outburst night
+}
+insertSize = 50000 # documents per insert_many call
+
+## FUNCTION DEFINITIONS #################################################################
+
+# makeIDs: takes the number of ids wanted and a random generator, returns unique
+# ZTF-style ids ( "ZTF" + 2 digit year + 7 letters, like ZTF21abcfgaq ). The
+# characters are filled in as a bytes grid, one column at a time, with no
+# per-id python string building
+def makeIDs( total, rng ):
+    years = rng.integers( 18, 25, total )
+    counter = np.arange( total )
+    chars = np.empty( ( total, 12 ), dtype=np.uint8 )
+    chars[ :, :3 ] = np.frombuffer( b"ZTF", dtype=np.uint8 )
+    chars[ :, 3 ] = ord( "0" ) + years // 10
+    chars[ :, 4 ] = ord( "0" ) + years % 10
+    for column, place in enumerate( range( 6, -1, -1 ) ):
+        chars[ :, 5 + column ] = ord( "a" ) + ( counter // 26 ** place ) % 26
+    return chars.view( "S12" )[ :, 0 ].astype( "U12" )
+
+# withinGroups: takes per-row values and the group sizes, returns the running sum
+# of the values restarted at the start of every group
+def withinGroups( values, counts ):
+    totals = np.cumsum( values )
+    firstRows = np.cumsum( counts ) - counts
+    before = totals[ firstRows ] - values[ firstRows ] # sum of every earlier group
+    return totals - np.repeat( before, counts )
+
+# makeCatalog: takes the number of asteroids and the synth settings, returns the
+# asteroid names ( asteroids_all order ) and a dict of mag18o8 columns sorted by
+# ( ssnamenr, jd )
+def makeCatalog( numAst, settings=synthDefaults ):
+    rng = np.random.default_rng( settings[ "seed" ] )
+
+    # sparse, sorted names like the real catalog numbering
+    names = np.sort( rng.choice( np.arange( 1, numAst * 10 + 1 ), numAst, replace=False ) )
+    counts = rng.lognormal( np.log( settings[ "obsMedian" ] ), settings[ "obsSpread" ], numAst )
+    counts = np.maximum( 3, counts.astype( np.int64 ) )
+    total = int( counts.sum( ) )
+    astIdx = np.repeat( np.arange( numAst ), counts )
+    starts = np.cumsum( counts ) - counts # first row of every asteroid
+    obsNum = np.arange( total ) - np.repeat( starts, counts )
+
+    # observations come in same-night pairs, a few nights apart
+    gaps = np.where( obsNum % 2 == 0, rng.integers( 1, 8, total ), 0 )
+    gaps[ obsNum == 0 ] = 0
+    night = rng.integers( 2458200, 2460000, numAst )[ astIdx ] + withinGroups( gaps, counts )
+    jd = night + 0.6 + 0.03 * ( obsNum % 2 ) + rng.uniform( 0, 0.01, total )
+    fid = rng.integers( 1, 3, total )
+
+    baseH = rng.uniform( 12, 19, numAst )[ astIdx ]
+    colour = rng.normal( 0.5, 0.1, numAst )[ astIdx ]
+    cols = {
+        "ssnamenr": names[ astIdx ],
+        "jd": jd,
+        "fid": fid,
+        "night": night,
+        "elong": 1 + np.abs( rng.normal( 0, 0.08, total ) ),
+        "rb": rng.beta( 8, 2, total ),
+        "H": baseH + ( fid == 1 ) * colour + rng.normal( 0, 0.15, total ),
+        "mag18omag8": rng.normal( 0, 0.05, total )
+    }
+
+    # inject outbursts: every observation on one night moves together. An
+    # asteroid's rows are contiguous, so they are sliced, not searched for
+    outAst = rng.choice( numAst, int( numAst * settings[ "outlierFrac" ] ), replace=False )
+    for ast in outAst:
+        rows = np.arange( starts[ ast ], starts[ ast ] + counts[ ast ] )
+        burst = rows[ night[ rows ] == night[ rng.choice( rows ) ] ]
+        cols[ "elong" ][ burst ] += rng.uniform( 0.5, 1.5 )
+        cols[ "mag18omag8" ][ burst ] -= rng.uniform( 0.3, 1.0 )
+        cols[ "rb" ][ burst ] *= rng.uniform( 0.3, 0.7 )
+
+    # the rest of the mag18o8 fields, plausible but not modelled
+    magpsf = cols[ "H" ] + rng.uniform( 3, 6, total )
+    obsdist = rng.uniform( 0.8, 4, total )
+    cols.update( {
+        "pid": rng.integers( 10 ** 12, 10 ** 13, total ),
+        "diffmaglim": rng.uniform( 19.5, 21, total ),
+        "ra": rng.uniform( 0, 360, total ),
+        "dec": rng.uniform( -30, 90, total ),
+        "magpsf": magpsf,
+        "sigmapsf": rng.uniform( 0.05, 0.2, total ),
+        "chipsf": rng.uniform( 0.5, 3, total ),
+        "magap": magpsf + rng.normal( 0, 0.05, total ),
+        "sigmagap": rng.uniform( 0.05, 0.2, total ),
+        "magapbig": magpsf + rng.normal( 0, 0.05, total ),
+        "sigmagapbig": rng.uniform( 0.05, 0.2, total ),
+        "distnr": rng.uniform( 0, 20, total ),
+        "magnr": rng.uniform( 15, 22, total ),
+        "fwhm": rng.uniform( 1.5, 4, total ),
+        "ssdistnr": rng.uniform( 0, 5, total ),
+        "ssmagnr": magpsf + rng.normal( 0, 0.1, total ),
+        "id": makeIDs( total, rng ),
+        "phaseangle": rng.uniform( 0, 30, total ),
+        "obsdist": obsdist,
+        "heliodist": obsdist + rng.uniform( 0.5, 1, total ),
+        "ltc": obsdist * 0.00577
+    } )
+    return names, cols
+
+# loadMongo: takes a client, the names and the columns, and loads them into the
+# ztf database's asteroids_all and mag18o8 collections ( replacing what's there )
+def loadMongo( client, names, cols ):
+    db = client[ snapsDB.dbName ]
+    db[ "asteroids_all" ].drop( )
+    db[ "mag18o8" ].drop( )
+    db[ "asteroids_all" ].insert_many( [ { "ssnamenr": int( name ) } for name in names ] )
+
+    colNames = list( cols )
+    total = len( cols[ "jd" ] )
+    for start in range( 0, total, insertSize ):
+        # tolist gives plain python values, which BSON can encode
+        values = [ cols[ col ][ start:start + insertSize ].tolist( ) for col in colNames ]
+        db[ "mag18o8" ].insert_many( [ dict( zip( colNames, row ) ) for row in zip( *values ) ] )
+
+    db[ "mag18o8" ].create_index( [ ( "ssnamenr", 1 ), ( "jd", 1 ) ] )
+    db[ "asteroids_all" ].create_index( [ ( "ssnamenr", 1 ) ] )
+    print( "Loaded " + str( len( names ) ) + " asteroids, " + str( total ) + " observations" )
+
+# writeCache: takes a cache directory, the names and the columns, and writes them
+# as a local observation cache ( plus name index ) without going through mongo
+def writeCache( cacheDir, names, cols ):
+    os.makedirs( cacheDir, exist_ok=True )
+    arrays = dict( cols )
+    arrays[ "index-names" ], arrays[ "index-offsets" ] = obsCache.buildIndex( cols[ "ssnamenr" ] )
+    meta = { "columns": list( cols ),
+             "nRows": int( len( cols[ "jd" ] ) ),
+             "lastJd": float( np.max( cols[ "jd" ] ) ) }
+    obsCache.saveColumns( cacheDir, arrays, meta )
+    obsCache.saveNameIndex( os.path.join( cacheDir, "astNames" ), names )
+    print( "Wrote cache at " + cacheDir + ": " + str( meta[ "nRows" ] ) + " observations" )
+    print( "Run with --cache " + cacheDir + " --cacheSync False --nameIndex " +
+           os.path.join( cacheDir, "astNames" ) )
+
+# benchmark: takes the number of asteroids to run, the first asteroid name and the
+# SNAPS run options. Times runProgram over them and viewOne on one asteroid
+def benchmark( maxIn, firstName, opts ):
+    snaps = importlib.import_module( "2astOutlierMatNew" )
+    runOpts = snaps.defaultOpts.copy( )
+    runOpts.update( opts )
+
+    outFile = os.path.join( tempfile.mkdtemp( ), "bench.csv" )
+    start = time.perf_counter( )
+    snaps.runProgram( maxIn, 0, True, [ 2, outFile ], 4, 0, False, runOpts )
+    runTime = time.perf_counter( ) - start
+    print( "runProgram: " + str( maxIn ) + " asteroids in " + str( round( runTime, 2 ) ) +
+           " s (" + str( round( maxIn / runTime, 1 ) ) + " asteroids/s)" )
+
+    start = time.perf_counter( )
+    snaps.viewOne( [ firstName, 'n', 0, 0 ], False, [ 2, "" ], 4, 0, False, runOpts )
+    print( "viewOne: " + str( round( time.perf_counter( ) - start, 3 ) ) + " s" )
+
+# getSynthOptions: takes the command line arguments and splits out the synth
+# flags. Returns the remaining arguments and the synth settings
+def getSynthOptions( argv ):
+    remaining = [ ]
+    settings = synthDefaults.copy( )
+    argNum = 0
+    while argNum < len( argv ):
+        flag = argv[ argNum ][ 2: ]
+        if argv[ argNum ].startswith( "--" ) and flag in synthDefaults and argNum + 1 < len( argv ):
+            settings[ flag ] = type( synthDefaults[ flag ] )( argv[ argNum + 1 ] )
+            argNum += 2
+        else:
+            remaining.append( argv[ argNum ] )
+            argNum += 1
+    return remaining, settings
+
+def main( ):
+    # no plot windows during a benchmark ( must be set before pyplot is imported )
+    import matplotlib
+    matplotlib.use( "Agg" )
+    argv, settings = getSynthOptions( sys.argv )
+    snaps = importlib.import_module( "2astOutlierMatNew" )
+    argv, opts = snaps.getOptions( argv )
+    numAst = int( argv[ 1 ] )
+    target = argv[ 2 ]
+    maxIn = int( argv[ 3 ] ) if len( argv ) > 3 else numAst
+
+    start = time.perf_counter( )
+    names, cols = makeCatalog( numAst, settings )
+    print( "Generated " + str( len( cols[ "jd" ] ) ) + " observations in " +
+           str( round( time.perf_counter( ) - start, 2 ) ) + " s" )
+
+    if target == "mock":
+        import mongomock # optional, only needed for the in-process stand-in
+        client = mongomock.MongoClient( )
+        loadMongo( client, names, cols )
+        snapsDB.setClient( client )
+    elif target.startswith( "mongodb://" ):
+        snapsDB.useServer( target )
+        loadMongo( snapsDB.getClient( ), names, cols )
+    else:
+        writeCache( target, names, cols )
+        return
+
+    # the name index would otherwise be shared with real runs
+    opts[ "nameIndex" ] = ""
+    benchmark( maxIn, names[ 0 ], opts )
+
+if __name__ == "__main__":
+    main( )